@@ -20,11 +20,20 @@ SCENARIOS["NCWC"] = ["NC", "WC"]  # Network Connectivity Plus Watershed Conditio
 # Metric fields that are inputs of the above scenarios
 METRICS = ["GainMiles", "Sinuosity", "Landcover", "SizeClasses"]
 
+# Scenario calculated from user-defined weights of CUSTOM_METRICS
+CUSTOM_SCENARIO = "CUSTOM"
+
+# Metric fields that can be weighted in the custom scenario
+CUSTOM_METRICS = METRICS + ["TESpp", "StreamOrder"]
+
 
 def calculate_score(series, ascending=True):
     """Calculate score based on the rank of a row's value within the sorted array of unique values.
     By default, the smallest unique value receives the lowest score, and the largest unique value
     receives the highest score.
+
+    Not used by calculate_tiers(); kept as the reference that the results of
+    calculate_group_score() must match for each group.
     
     Parameters
     ----------
@@ -58,6 +67,9 @@ def calculate_score(series, ascending=True):
 def calculate_composite_score(dataframe, weights=None):
     """Calculate composite, weighted score across one or more columns.
     The lowest tier (1) is the highest 95% of the composite score range.
+
+    Reference implementation only; calculate_tiers() calculates the weighted sum
+    of scores as a matrix product, which must give the same result.
     
     Parameters
     ----------
@@ -99,6 +111,9 @@ def calculate_tier(series):
     """Calculate tiers based on 5% increments of the score range.
     The lowest tier (1) is the highest 95% of the composite score range.
 
+    Kept to document the tiers that calculate_group_tier() calculates for every
+    group at once; it is not called when ranking.
+
     Parameters
     ----------
     series : pandas.Series
@@ -120,12 +135,203 @@ def calculate_tier(series):
     return (np.digitize(relative_value, bins) + 1).astype("uint8")
 
 
-def calculate_tiers(df, group_field=None, prefix=""):
+def get_groups(groups):
+    """Calculate the segments of each group within the sorted order of groups.
+
+    Parameters
+    ----------
+    groups : ndarray of int
+        group code of each row
+
+    Returns
+    -------
+    tuple of (order, starts, segment)
+        order: ndarray of row positions sorted by group
+        starts: ndarray of the start of each group within order
+        segment: ndarray of the group number (0...number of groups - 1) of each row in order
+    """
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+
+    is_start = np.ones(len(order), dtype="bool")
+    is_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+
+    return order, np.flatnonzero(is_start), np.cumsum(is_start) - 1
+
+
+def calculate_group_score(values, groups, ascending=True):
+    """Calculate score of each value based on its rank within the sorted unique
+    values of its group, for all groups at once.
+
+    Equivalent to calculate_score() applied to each group.
+
+    Parameters
+    ----------
+    values : ndarray
+    groups : ndarray of int
+        group code of each value
+    ascending : boolean (default: True)
+        If True, the lowest unique value in each group receives the lowest score.
+
+    Returns
+    -------
+    ndarray, dtype is float64
+        score value for each entry in values
+    """
+    scores = np.empty(len(values), dtype="float64")
+    if not len(values):
+        return scores
+
+    # Round to 3 decimal places to avoid unnecessary precision
+    values = np.round(values, 3)
+
+    # sort by group, then value
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+
+    is_start = np.ones(len(order), dtype="bool")
+    is_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    segment = np.cumsum(is_start) - 1
+
+    # a new unique value starts at the start of each group or change in value
+    is_unique = is_start.copy()
+    changed = sorted_values[1:] != sorted_values[:-1]
+    if sorted_values.dtype.kind == "f":
+        # NaN values are a single unique value
+        changed &= ~(np.isnan(sorted_values[1:]) & np.isnan(sorted_values[:-1]))
+    is_unique[1:] |= changed
+
+    # dense rank of each value within its group, starting at 0
+    unique_count = np.cumsum(is_unique)
+    rank = unique_count - unique_count[is_start][segment]
+    max_rank = np.add.reduceat(is_unique.astype("int64"), np.flatnonzero(is_start)) - 1
+
+    if not ascending:
+        rank = max_rank[segment] - rank
+
+    rank_size = np.where(max_rank > 0, max_rank, 1)  # to prevent divide by 0 error
+    scores[order] = rank / rank_size[segment]  # on a 0-1 scale
+
+    return scores
+
+
+def calculate_group_tier(scores, groups):
+    """Calculate tiers based on 5% increments of the score range within each group,
+    for all groups at once.
+
+    Equivalent to calculate_tier() applied to each group.
+
+    Parameters
+    ----------
+    scores : ndarray
+    groups : ndarray of int
+        group code of each score
+
+    Returns
+    -------
+    ndarray, dtype is uint8
+        tiers
+    """
+    if not len(scores):
+        return np.empty(0, dtype="uint8")
+
+    order, starts, segment = get_groups(groups)
+    sorted_scores = scores[order]
+
+    # calculate relative score within each group
+    group_min = np.maximum(np.fmin.reduceat(sorted_scores, starts), 0)
+    group_range = np.fmax.reduceat(sorted_scores, starts) - group_min
+    group_range[group_range == 0] = 1  # to avoid divide by 0
+
+    relative_value = np.empty(len(scores), dtype="float64")
+    relative_value[order] = (
+        100.0 * (sorted_scores - group_min[segment]) / group_range[segment]
+    )
+
+    # break into 5% increments, such that tier 0 is in top 95% of the relative scores
+    bins = np.arange(95, -5, -5)
+    return (np.digitize(relative_value, bins) + 1).astype("uint8")
+
+
+def calculate_group_tiers(df, groups, weights=None):
+    """Calculate scores and tiers for each scenario within each group, for all
+    groups in a single pass.
+
+    If weights are provided, the custom scenario (CUSTOM_SCENARIO) is calculated as
+    the product of the matrix of scores for each metric and the weights.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        data frame containing METRICS fields, and any other fields in weights
+    groups : ndarray of int
+        group code of each row.  Rows with negative group codes are not scored.
+    weights : dict, optional (default: None)
+        mapping of CUSTOM_METRICS field to weight.  It is up to caller to make
+        sure these sum to 1.
+
+    Returns
+    -------
+    pandas.DataFrame
+        data frame with the same index as df, with a score field (_score) for each
+        metric and a score field and tier field (_tier) for each scenario.
+        Scores are on a 0-1 scale.
+    """
+    valid = groups >= 0
+    if not valid.all():
+        results = calculate_group_tiers(df.loc[valid], groups[valid], weights=weights)
+        return results.reindex(df.index)
+
+    results = pd.DataFrame(index=df.index)
+
+    # calculate score for each input field
+    for field in METRICS:
+        results["{}_score".format(field)] = calculate_group_score(
+            df[field].values, groups
+        )
+
+    # calculate composite score and tier
+    for scenario, inputs in SCENARIOS.items():
+        weight = 1.0 / len(inputs)
+
+        # weighted sum of input scores, equivalent to calculate_composite_score()
+        score = results["{}_score".format(inputs[0])].values * weight
+        for field in inputs[1:]:
+            score = score + results["{}_score".format(field)].values * weight
+
+        results["{}_score".format(scenario)] = score
+        results["{}_tier".format(scenario)] = calculate_group_tier(score, groups)
+
+    if weights:
+        # score any metrics not already scored above
+        metrics = list(weights.keys())
+        scores = np.column_stack(
+            [
+                results["{}_score".format(field)].values
+                if field in METRICS
+                else calculate_group_score(df[field].values, groups)
+                for field in metrics
+            ]
+        )
+        score = scores @ np.array(
+            [weights[field] for field in metrics], dtype="float64"
+        )
+
+        results["{}_score".format(CUSTOM_SCENARIO)] = score
+        results["{}_tier".format(CUSTOM_SCENARIO)] = calculate_group_tier(score, groups)
+
+    return results
+
+
+def calculate_tiers(df, group_field=None, prefix="", weights=None):
     """Calculate tiers for each input scenario, which is based on combining scores for
     each scenario's inputs.
 
     Calculations will only be performed where the "HasNetwork" field is true; otherwise results will be -1.
-    
+
+    All groups are calculated at once using calculate_group_tiers().
+
     Parameters
     ----------
     df : pandas.DataFrame
@@ -134,53 +340,38 @@ def calculate_tiers(df, group_field=None, prefix=""):
         Name of a column to use for grouping tier calculation (all scores will be based on values within each group).
     prefix: str, optional (default: "")
         Prefix to add to the resulting score and tier fields.
-    
+    weights: dict, optional (default: None)
+        If provided, also calculate the custom scenario (CUSTOM_SCENARIO) from these
+        weights of CUSTOM_METRICS fields, which must sum to 1.
+
     Returns
     -------
     pandas.DataFrame
-        returns data frame with a score field (_score) and tier field (_tier) for each scenario. 
+        returns data frame with a score field (_score) and tier field (_tier) for each scenario.
         Scores are on a 0-100 (percent) scale.
     """
 
-    columns = METRICS.copy()
-    if group_field is not None:
-        columns.append(group_field)
-
     # Subset just the metrics fields for just those records with networks
-    results = df.loc[df.HasNetwork, columns].copy()
+    has_network = df.HasNetwork.values.astype("bool")
+    columns = METRICS + [c for c in (weights or {}) if not c in METRICS]
+    results = df.loc[has_network, columns]
 
-    groups = results[group_field].unique() if group_field is not None else [None]
+    if group_field is not None:
+        # records with null groups are not scored
+        groups = pd.factorize(df.loc[has_network, group_field])[0]
+    else:
+        groups = np.zeros(len(results), dtype="int64")
 
-    for group in groups:
-        row_index = (
-            results[group_field] == group if group is not None else results.index
-        )
-        # calculate score for each input field
-        for field in METRICS:
-            results.loc[row_index, "{}_score".format(field)] = calculate_score(
-                results.loc[row_index, field]
-            )
-
-        # calculate composite score and tier
-        for scenario, inputs in SCENARIOS.items():
-            input_scores = ["{}_score".format(field) for field in inputs]
-            score_field = "{}_score".format(scenario)
-
-            results.loc[row_index, score_field] = calculate_composite_score(
-                results.loc[row_index][input_scores]
-            )
-            results.loc[row_index, "{}_tier".format(scenario)] = calculate_tier(
-                results.loc[row_index, score_field]
-            )
-
-    results_fields = results.columns.drop(columns)
+    results = calculate_group_tiers(results, groups, weights=weights)
+
+    results_fields = results.columns
     score_fields = [c for c in results_fields if c.endswith("_score")]
 
     # convert scores to percent scale
     results[score_fields] = (results[score_fields] * 100).round()
 
     # join back to original and fill N/A and fix dtypes
-    df = df.join(results[results_fields])
+    df = df.join(results)
     df[results_fields] = df[results_fields].fillna(-1).astype("int8")
 
     if prefix:
@@ -189,4 +380,3 @@ def calculate_tiers(df, group_field=None, prefix=""):
         )
 
     return df
-
@@ -0,0 +1,92 @@
+"""
+Precompute custom tiers of barriers within each summary unit, for use by the API.
+
+Most requests to rank barriers are for a single summary unit without filters;
+the API serves these from the precomputed tiers instead of calculating them
+for each request.
+
+This is run AFTER `rank_dams.py` and `rank_small_barriers.py`.
+
+Inputs:
+* `data/api/dams.arrow` (or `dams.feather`) created by `rank_dams.py`
+* `data/api/small_barriers.arrow` (or `small_barriers.feather`) created by `rank_small_barriers.py`
+
+Outputs:
+* `data/api/dams_unit_tiers.arrow`: NC, WC, and NCWC tiers of dams with networks within each summary unit
+* `data/api/small_barriers_unit_tiers.arrow`: same for small barriers
+
+Each output has a row for each barrier within each summary unit of each layer,
+sorted by layer and unit, with the following fields:
+layer, unit, id, NC_tier, WC_tier, NCWC_tier
+
+The modification time and size of the data file used are stored in the metadata
+of each output as "source"; the API ignores outputs that do not match the current
+data file.
+"""
+
+from pathlib import Path
+from time import time
+
+import pandas as pd
+
+from analysis.rank.lib.tiers import calculate_group_tiers, METRICS
+from api.constants import LAYER_FIELDS, CUSTOM_TIER_FIELDS
+from api.lib.store import get_file_version, get_store_path, read_store, write_table
+
+
+start = time()
+
+api_dir = Path("data/api")
+
+
+for name in ("dams", "small_barriers"):
+    print("Precomputing tiers for {}...".format(name))
+    name_start = time()
+
+    source_path = get_store_path(api_dir, name)
+    source = get_file_version(source_path)
+
+    # data are sorted by HUC12; this order is retained within each unit below
+    df = read_store(api_dir, name)
+    df = df.loc[df.HasNetwork]
+
+    merged = []
+    for layer in LAYER_FIELDS:
+        # records with null units are not ranked
+        groups, units = pd.factorize(df[layer])
+        results = calculate_group_tiers(df[METRICS], groups)
+
+        has_unit = groups >= 0
+        layer_df = pd.DataFrame(
+            {
+                "layer": layer,
+                "unit": units[groups[has_unit]],
+                "id": df.index.values[has_unit],
+            }
+        )
+        for field in CUSTOM_TIER_FIELDS:
+            layer_df[field] = results[field].values[has_unit].astype("int8")
+
+        merged.append(layer_df.sort_values(by="unit", kind="mergesort"))
+
+        print("{}: {:,} units".format(layer, len(units)))
+
+    merged = pd.concat(merged, ignore_index=True, sort=False)
+    merged["layer"] = merged.layer.astype("category")
+    merged["unit"] = merged.unit.astype("category")
+
+    if get_file_version(source_path) != source:
+        raise RuntimeError(
+            "{} changed while tiers were calculated; rerun this script".format(
+                source_path.name
+            )
+        )
+
+    write_table(
+        merged, api_dir / "{}_unit_tiers.arrow".format(name), {"source": source}
+    )
+
+    print("{} done in {:.2f}s".format(name, time() - name_start))
+
+
+print("Done in {:.2f}".format(time() - start))
@@ -6,6 +6,7 @@ Input:
 
 Outputs:
 * `data/api/dams.feather`: processed dam data for use by the API
+* `data/api/dams.arrow`: uncompressed copy of the above, sorted by HUC12, that is memory-mapped by the API
 * `data/tiles/dams_with_networks.csv`: Dams with networks for creating vector tiles in tippecanoe
 * `data/tiles/dams_without_networks.csv`: Dams without networks for creating vector tiles in tippecanoe
 
@@ -31,6 +32,7 @@ from analysis.network.lib.barriers import DAMS_ID
 from analysis.rank.lib.spatial_joins import add_spatial_joins
 from analysis.rank.lib.tiers import calculate_tiers
 from analysis.rank.lib.metrics import update_network_metrics
+from api.lib.store import write_store
 from api.constants import DAM_API_FIELDS, UNIT_FIELDS, DAM_CORE_FIELDS
 
 start = time()
@@ -208,6 +210,8 @@ df.to_csv(
 
 # save for API
 serialize_df(df[DAM_API_FIELDS].reset_index(), api_dir / "dams.feather")
+# uncompressed, sorted copy that is memory-mapped by the API
+write_store(df[DAM_API_FIELDS].reset_index(), api_dir / "dams.arrow")
 
 # Drop fields that can be calculated on frontend
 keep_fields = [
@@ -9,6 +9,7 @@ Inputs:
 
 Outputs:
 * `data/api/small_barriers.feather`: processed small barriers data for use by the API
+* `data/api/small_barriers.arrow`: uncompressed copy of the above, sorted by HUC12, that is memory-mapped by the API
 * `data/tiles/barriers_with_networks.csv`: small barriers with networks for creating vector tiles in tippecanoe
 * `data/tiles/barriers_background.csv`: small barriers without networks and road crossings for creating vector tiles in tippecanoe
 
@@ -31,6 +32,7 @@ from analysis.network.lib.barriers import DAMS_ID
 from analysis.rank.lib.spatial_joins import add_spatial_joins
 from analysis.rank.lib.tiers import calculate_tiers
 from analysis.rank.lib.metrics import update_network_metrics
+from api.lib.store import write_store
 from api.constants import SB_API_FIELDS, SB_CORE_FIELDS, UNIT_FIELDS
 
 start = time()
@@ -184,6 +186,8 @@ df.to_csv(
 # Drop any fields we don't need for API or tippecanoe
 # save for API
 serialize_df(df[SB_API_FIELDS].reset_index(), api_dir / "small_barriers.feather")
+# uncompressed, sorted copy that is memory-mapped by the API
+write_store(df[SB_API_FIELDS].reset_index(), api_dir / "small_barriers.arrow")
 
 # Drop fields that can be calculated on frontend
 keep_fields = [
@@ -0,0 +1,302 @@
+"""ASGI entry point for the API.
+
+Exposes the same routes as the Flask API in `api/server.py`.  Fast requests
+(e.g., query) are served by the Flask app in a thread pool of this process.
+CPU-bound requests (rank and download) are sent to a bounded pool of worker
+processes, so that they do not block other requests.  Worker processes write
+responses to a temporary spool file, which is streamed to the client as it is
+written, so that large downloads are not held in memory.
+
+Identical CPU-bound requests that arrive while one is running stream its
+response from the same spool file instead of running again in another worker
+process.
+
+If the number of pending CPU-bound requests reaches API_MAX_PENDING, additional
+requests are rejected with a 503 response until capacity is available.
+
+To run:
+`uvicorn api.asgi:app --port 5000`
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, StreamingResponse
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+# Importing the server loads data before worker processes are forked
+from api.server import app as flask_app, metrics
+
+
+# Number of worker processes for CPU-bound requests
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", os.cpu_count() or 1))
+
+# Maximum number of CPU-bound requests running or waiting for a worker process
+MAX_PENDING = int(os.getenv("API_MAX_PENDING", POOL_SIZE * 4))
+
+# Request headers that responses depend on, in addition to the URL and body
+KEY_HEADERS = ("accept", "accept-encoding", "if-none-match")
+
+# CPU-bound routes: rank, batch rank, and download
+# (/api/v1/<barrier_type>/<format>/<layer>)
+CPU_BOUND_ROUTES = re.compile(r"^/api/v1/[^/]+/(rank|csv)/[^/]+(/batch)?$")
+
+# Maximum number of bytes read from a spool file at a time
+CHUNK_SIZE = 1000000
+
+# Number of seconds to wait for more of a response to be written to a spool file
+POLL_INTERVAL = 0.05
+
+
+# Barrier shared by worker processes while they are started; see start_worker()
+startup_barrier = None
+
+
+def init_worker(barrier):
+    global startup_barrier
+    startup_barrier = barrier
+
+
+def start_worker():
+    """Wait until all worker processes have started.
+
+    Each call blocks a worker process until every worker process has made the
+    same call, so that the pool must start all of its processes to complete them.
+    """
+    startup_barrier.wait()
+
+
+def handle_request(method, base_url, path, query_string, headers, body, spool_path):
+    """Run request through the Flask app in a worker process, and write the
+    response to a spool file as it is produced.
+
+    The first line of the spool file is a JSON array of the status code and
+    headers of the response; it is followed by the body.
+
+    Parameters
+    ----------
+    method : str
+    base_url : str
+    path : str
+    query_string : str
+    headers : list of (name, value)
+    body : bytes
+    spool_path : str
+        path of the spool file
+
+    Returns
+    -------
+    dict
+        observations of request durations in the worker process, which are
+        added to the metrics of the main process
+    """
+    environ = EnvironBuilder(
+        method=method,
+        base_url=base_url,
+        path=path,
+        query_string=query_string,
+        headers=headers,
+        data=body,
+    ).get_environ()
+
+    app_iter, status, headers = run_wsgi_app(flask_app, environ)
+    try:
+        with open(spool_path, "wb") as out:
+            head = [int(status.split(" ", 1)[0]), list(headers.items())]
+            out.write(json.dumps(head).encode("utf-8") + b"\n")
+            out.flush()
+
+            for chunk in app_iter:
+                out.write(chunk)
+                out.flush()
+
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+    return metrics.drain()
+
+
+class API(object):
+    """ASGI app that dispatches CPU-bound requests to a process pool and all
+    other requests to the Flask app.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, max_pending=MAX_PENDING):
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = {}
+        self.pool = None
+        self.wsgi = WSGIMiddleware(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+
+        elif scope["type"] == "http" and CPU_BOUND_ROUTES.match(scope["path"]):
+            await self.offload(scope, receive, send)
+
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await self.start_pool()
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def start_pool(self):
+        """Create the pool and start all of its worker processes.
+
+        Worker processes are forked from this process.  They are started before
+        any requests are handled, so that they are not forked while other threads
+        (e.g., request threads or the data watcher) hold locks, which would remain
+        locked in the worker processes.
+        """
+        barrier = multiprocessing.Barrier(self.pool_size)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.pool_size, initializer=init_worker, initargs=(barrier,)
+        )
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self.pool, start_worker)
+                for _ in range(self.pool_size)
+            )
+        )
+
+    async def offload(self, scope, receive, send):
+        request = Request(scope, receive)
+        body = await request.body()
+
+        key = (request.method, str(request.url), body) + tuple(
+            request.headers.get(name, "") for name in KEY_HEADERS
+        )
+
+        # running and pending are only modified within the event loop, so no
+        # lock is needed
+        task, spool_path = self.running.get(key, (None, None))
+        if task is None:
+            if self.pending >= self.max_pending:
+                response = PlainTextResponse(
+                    "server is busy; please try again later",
+                    status_code=503,
+                    headers={"Retry-After": "5"},
+                )
+                await response(scope, receive, send)
+                return
+
+            fd, spool_path = tempfile.mkstemp(prefix="api-response-")
+            os.close(fd)
+
+            self.pending += 1
+            task = asyncio.ensure_future(self.run(request, body, spool_path))
+            self.running[key] = (task, spool_path)
+            task.add_done_callback(lambda _: self.finish(key, spool_path))
+
+        # the spool file is opened before the task is done, after which it is
+        # removed; requests that are streaming it can still read it
+        with open(spool_path, "rb") as spool:
+            chunks = self.read_spool(task, spool)
+
+            head = b""
+            async for chunk in chunks:
+                head += chunk
+                if b"\n" in head:
+                    break
+
+            head, rest = head.split(b"\n", 1)
+            status, headers = json.loads(head.decode("utf-8"))
+
+            async def iter_body():
+                if rest:
+                    yield rest
+
+                async for chunk in chunks:
+                    yield chunk
+
+            response = StreamingResponse(iter_body(), status_code=status)
+            response.raw_headers = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+            await response(scope, receive, send)
+
+    def finish(self, key, spool_path):
+        self.running.pop(key, None)
+        os.unlink(spool_path)
+
+    async def read_spool(self, task, spool):
+        """Read the spool file of a task while it is written by a worker process.
+
+        Waiting for the task does not cancel it if this client disconnects.
+
+        Parameters
+        ----------
+        task : asyncio.Future
+            task that runs the request; see run()
+        spool : file object
+            spool file of the task, opened for reading
+
+        Yields
+        ------
+        bytes
+        """
+        while True:
+            # all data are written once the task is done
+            done = task.done()
+
+            # reads of a local file are not expected to block the event loop
+            # for long
+            data = spool.read(CHUNK_SIZE)
+            if data:
+                yield data
+
+            elif done:
+                # raise the exception of the task, if any
+                task.result()
+                return
+
+            else:
+                await asyncio.wait([task], timeout=POLL_INTERVAL)
+
+    async def run(self, request, body, spool_path):
+        """Run request in a worker process, and release its place among the
+        pending requests when complete.
+        """
+        try:
+            observations = await asyncio.get_running_loop().run_in_executor(
+                self.pool,
+                handle_request,
+                request.method,
+                "{0}://{1}".format(request.url.scheme, request.url.netloc),
+                request.url.path,
+                request.url.query,
+                list(request.headers.items()),
+                body,
+                spool_path,
+            )
+
+        finally:
+            self.pending -= 1
+
+        metrics.merge(observations)
+
+
+app = API()
@@ -0,0 +1,360 @@
+"""
+Generate synthetic dams and small barriers data for benchmarking the API.
+
+Data have all fields used by the API (DAM_API_FIELDS and SB_API_FIELDS) with the
+same data types as created by `analysis/rank/rank_dams.py` and
+`analysis/rank/rank_small_barriers.py`.
+
+Summary units are nested as in the real data: HUC12s are nested within HUC8s and
+HUC6s, and each HUC12 falls within a single state, county, and level 3 / 4
+ecoregion.  Barriers are distributed unevenly across HUC12s and states, so that
+some summary units contain many more barriers than others.
+
+Outputs:
+* `<out>/dams.feather` and `<out>/small_barriers.feather`
+* `<out>/dams.arrow` and `<out>/small_barriers.arrow`: uncompressed copies sorted
+  by HUC12 that are memory-mapped by the API
+
+To run:
+`python -m api.benchmark.generate_data --rows 100000 --out data/benchmark`
+
+Then run the API or benchmark against these by setting API_DATA_DIR to <out>.
+"""
+
+import argparse
+import os
+from pathlib import Path
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from analysis.rank.lib.metrics import GAINMILES_BINS, SPP_BINS, STREAMORDER_BINS
+from analysis.rank.lib.tiers import calculate_tiers
+from api.constants import (
+    DAM_API_FIELDS,
+    SB_API_FIELDS,
+    FEASIBILITY_DOMAIN,
+    PURPOSE_DOMAIN,
+    CONSTRUCTION_DOMAIN,
+    DAM_CONDITION_DOMAIN,
+    RECON_DOMAIN,
+    BARRIER_SEVERITY_DOMAIN,
+    CROSSING_TYPE_DOMAIN,
+    ROAD_TYPE_DOMAIN,
+    BARRIER_CONDITION_DOMAIN,
+)
+from api.lib.store import write_store
+
+
+# States within the SARP region, with FIPS code and relative number of barriers
+STATES = {
+    "AL": ("01", 6),
+    "AR": ("05", 5),
+    "FL": ("12", 3),
+    "GA": ("13", 9),
+    "KY": ("21", 4),
+    "LA": ("22", 2),
+    "MO": ("29", 8),
+    "MS": ("28", 5),
+    "NC": ("37", 9),
+    "OK": ("40", 6),
+    "PR": ("72", 1),
+    "SC": ("45", 5),
+    "TN": ("47", 7),
+    "TX": ("48", 10),
+    "VA": ("51", 6),
+}
+
+# HUC2 regions within the SARP region
+HUC2S = ["02", "03", "05", "06", "08", "10", "11", "12", "13", "21"]
+
+# Approximate number of HUC12s in the region, reached at 2M barriers
+MAX_HUC12S = 30000
+
+# Number of HUC12s per HUC8, HUC8s per HUC6, and counties per state
+HUC12S_PER_HUC8 = 30
+HUC8S_PER_HUC6 = 8
+COUNTIES_PER_STATE = 80
+
+NUM_ECO3 = 25
+ECO4_PER_ECO3 = 8
+
+# Approximate extent of the region
+BOUNDS = (-106.6, 17.9, -75.2, 40.6)
+
+
+def classify(values, bins):
+    """Classify values into bins, numbered from the first bin.
+
+    Equivalent to the classify_*() functions in `analysis/rank/lib/metrics.py`,
+    which require values above the highest bin.
+    """
+    return np.digitize(values, bins[1:]) + bins[0]
+
+
+def choice(rng, values, size, p=None):
+    values = list(values)
+    return np.asarray(values)[rng.choice(len(values), size=size, p=p)]
+
+
+def generate_units(rng, count):
+    """Generate nested summary units.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+    count : int
+        number of HUC12s
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per HUC12
+    """
+    num_huc8s = max(count // HUC12S_PER_HUC8, 1)
+    num_huc6s = max(num_huc8s // HUC8S_PER_HUC6, 1)
+
+    # HUC6s are numbered within HUC2 regions
+    huc6 = pd.Series(
+        [
+            "{0}{1:04d}".format(HUC2S[i % len(HUC2S)], i // len(HUC2S) + 1)
+            for i in range(num_huc6s)
+        ]
+    )
+
+    # HUC8s are numbered within HUC6s
+    huc8_huc6 = rng.integers(0, num_huc6s, num_huc8s)
+    huc8_num = pd.Series(huc8_huc6).groupby(huc8_huc6).cumcount().values + 1
+    huc8 = pd.Series(
+        ["{0}{1:02d}".format(huc6[i], n % 100) for i, n in zip(huc8_huc6, huc8_num)]
+    )
+
+    # attributes of HUC8s that are shared by their HUC12s
+    states = list(STATES.keys())
+    state_p = np.array([STATES[s][1] for s in states], dtype="float")
+    state_p /= state_p.sum()
+    huc8_state = choice(rng, states, num_huc8s, p=state_p)
+    huc8_eco3 = rng.integers(0, NUM_ECO3, num_huc8s)
+    huc8_lon = rng.uniform(BOUNDS[0], BOUNDS[2], num_huc8s)
+    huc8_lat = rng.uniform(BOUNDS[1], BOUNDS[3], num_huc8s)
+
+    # HUC12s are numbered within HUC8s
+    huc12_huc8 = rng.integers(0, num_huc8s, count)
+    huc12_num = pd.Series(huc12_huc8).groupby(huc12_huc8).cumcount().values + 1
+    units = pd.DataFrame(
+        {
+            "HUC12": [
+                "{0}{1:04d}".format(huc8[i], n % 10000)
+                for i, n in zip(huc12_huc8, huc12_num)
+            ],
+            "HUC8": huc8.values[huc12_huc8],
+            "HUC6": huc6.values[huc8_huc6[huc12_huc8]],
+        }
+    )
+
+    # most HUC12s are in the same state as their HUC8, others are in a random state
+    state = huc8_state[huc12_huc8]
+    other = rng.random(count) < 0.1
+    state[other] = choice(rng, states, other.sum(), p=state_p)
+    units["State"] = state
+
+    county = rng.integers(1, COUNTIES_PER_STATE + 1, count) * 2 - 1
+    units["COUNTYFIPS"] = [
+        "{0}{1:03d}".format(STATES[s][0], c) for s, c in zip(state, county)
+    ]
+    units["County"] = ["County {}".format(c) for c in units.COUNTYFIPS]
+
+    eco3 = huc8_eco3[huc12_huc8]
+    units["ECO3"] = [
+        "{0}.{1}.{2}".format(i // 9 + 5, i // 3 % 3 + 1, i % 3 + 1) for i in eco3
+    ]
+    units["ECO4"] = [
+        "{0}{1}".format(i + 45, "abcdefgh"[j])
+        for i, j in zip(eco3, rng.integers(0, ECO4_PER_ECO3, count))
+    ]
+
+    units["lon"] = huc8_lon[huc12_huc8]
+    units["lat"] = huc8_lat[huc12_huc8]
+    units["Basin"] = ["Basin {}".format(h) for h in units.HUC6]
+
+    # priority watersheds
+    units["HUC8_USFS"] = rng.choice(4, num_huc8s, p=[0.7, 0.1, 0.1, 0.1])[
+        huc12_huc8
+    ].astype("uint8")
+    units["HUC8_COA"] = (rng.random(num_huc8s) < 0.2)[huc12_huc8].astype("uint8")
+    units["HUC8_SGCN"] = (rng.random(num_huc8s) < 0.15)[huc12_huc8].astype("uint8")
+
+    # species are summarized by HUC12
+    for col in ["TESpp", "StateSGCNSpp", "RegionalSGCNSpp"]:
+        units[col] = np.minimum(rng.poisson(1.5, count), 30).astype("uint8")
+
+    return units
+
+
+def generate_barriers(rng, units, count):
+    """Generate fields shared by dams and small barriers.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+    units : pandas.DataFrame
+        summary units created by generate_units()
+    count : int
+        number of barriers
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    # number of barriers per HUC12 is highly skewed
+    p = rng.lognormal(0, 1.2, len(units))
+    p /= p.sum()
+    df = units.iloc[rng.choice(len(units), size=count, p=p)].reset_index(drop=True)
+
+    df.insert(0, "id", np.arange(count, dtype="uint32"))
+    df["lon"] = (df.lon + rng.normal(0, 0.2, count)).astype("float32")
+    df["lat"] = (df.lat + rng.normal(0, 0.2, count)).astype("float32")
+
+    df["SARPID"] = "SARP" + df.id.astype(str)
+    df["Name"] = np.where(
+        rng.random(count) < 0.6, "Barrier " + df.id.astype(str), ""
+    ).astype("object")
+    df["Source"] = choice(rng, ["SARP", "State inventory", "NHD"], count)
+
+    df["OwnerType"] = rng.choice(9, count, p=[0.8] + [0.025] * 8).astype("uint8")
+    df["ProtectedLand"] = df.OwnerType > 0
+
+    df["HasNetwork"] = rng.random(count) < 0.6
+    df["Excluded"] = ~df.HasNetwork & (rng.random(count) < 0.05)
+
+    ### Network metrics; -1 for barriers without networks
+    has_network = df.HasNetwork.values
+
+    def metric(values, dtype="float32"):
+        return np.where(has_network, values, -1).astype(dtype)
+
+    upstream = rng.lognormal(0.5, 1.5, count)
+    downstream = rng.lognormal(1, 1.5, count)
+    free_downstream = downstream * rng.random(count)
+
+    df["TotalUpstreamMiles"] = metric(upstream.round(3))
+    df["FreeUpstreamMiles"] = metric((upstream * rng.random(count)).round(3))
+    df["TotalDownstreamMiles"] = metric(downstream.round(3))
+    df["FreeDownstreamMiles"] = metric(free_downstream.round(3))
+    df["GainMiles"] = metric(np.minimum(upstream, free_downstream).round(3))
+    df["TotalNetworkMiles"] = metric((upstream + free_downstream).round(3))
+    df["Sinuosity"] = metric((1 + rng.exponential(0.15, count)).round(3))
+    df["Landcover"] = metric(rng.integers(0, 101, count), "int8")
+    df["SizeClasses"] = metric(
+        rng.choice(5, count, p=[0.5, 0.25, 0.15, 0.07, 0.03]), "int8"
+    )
+    df["StreamOrder"] = metric(
+        rng.choice(7, count, p=[0.45, 0.25, 0.13, 0.08, 0.05, 0.03, 0.01]) + 1,
+        "int8",
+    )
+
+    df["GainMilesClass"] = classify(df.GainMiles, GAINMILES_BINS).astype("int8")
+    df["StreamOrderClass"] = classify(df.StreamOrder, STREAMORDER_BINS).astype("int8")
+    for col in ["TESpp", "StateSGCNSpp", "RegionalSGCNSpp"]:
+        df["{}Class".format(col)] = classify(df[col], SPP_BINS).astype("uint8")
+
+    ### Tiers for the region and by state
+    df = calculate_tiers(df, prefix="SE")
+    df = calculate_tiers(df, group_field="State", prefix="State")
+
+    return df
+
+
+def generate_dams(rng, units, count):
+    df = generate_barriers(rng, units, count)
+
+    df["NIDID"] = np.where(
+        rng.random(count) < 0.4, df.State + df.id.astype(str).str.zfill(5), ""
+    ).astype("object")
+    df["River"] = np.where(
+        rng.random(count) < 0.7, "River " + (df.id % 5000).astype(str), ""
+    ).astype("object")
+    df["Year"] = np.where(
+        rng.random(count) < 0.5, rng.integers(1800, 2020, count), 0
+    ).astype("uint16")
+
+    height = np.where(rng.random(count) < 0.8, rng.lognormal(2.5, 0.8, count), 0)
+    df["Height"] = height.round(1).astype("float32")
+    df["HeightClass"] = np.digitize(height, [1e-6, 5, 10, 25, 50, 100]).astype("uint8")
+
+    df["Construction"] = choice(rng, CONSTRUCTION_DOMAIN.keys(), count).astype("uint8")
+    df["Purpose"] = choice(rng, PURPOSE_DOMAIN.keys(), count).astype("uint8")
+    df["Condition"] = choice(rng, DAM_CONDITION_DOMAIN.keys(), count).astype("uint8")
+    df["Feasibility"] = choice(rng, FEASIBILITY_DOMAIN.keys(), count).astype("uint8")
+    df["Recon"] = choice(rng, RECON_DOMAIN.keys(), count).astype("uint8")
+
+    return df.sort_values(by="HUC12", kind="mergesort")[["id"] + DAM_API_FIELDS]
+
+
+def generate_small_barriers(rng, units, count):
+    df = generate_barriers(rng, units, count)
+
+    df["LocalID"] = "L" + df.id.astype(str)
+    df["CrossingCode"] = "C" + (df.id * 7 % 1000003).astype(str)
+    df["Stream"] = np.where(
+        rng.random(count) < 0.7, "Creek " + (df.id % 5000).astype(str), ""
+    ).astype("object")
+    df["Road"] = np.where(
+        rng.random(count) < 0.8, "Road " + (df.id % 20000).astype(str), ""
+    ).astype("object")
+
+    df["RoadTypeClass"] = choice(rng, ROAD_TYPE_DOMAIN.keys(), count).astype("uint8")
+    df["RoadType"] = df.RoadTypeClass.map(ROAD_TYPE_DOMAIN)
+    df["CrossingTypeClass"] = choice(rng, CROSSING_TYPE_DOMAIN.keys(), count).astype(
+        "uint8"
+    )
+    df["CrossingType"] = df.CrossingTypeClass.map(CROSSING_TYPE_DOMAIN)
+    df["ConditionClass"] = choice(rng, BARRIER_CONDITION_DOMAIN.keys(), count).astype(
+        "uint8"
+    )
+    df["Condition"] = df.ConditionClass.map(BARRIER_CONDITION_DOMAIN)
+    df["SeverityClass"] = choice(rng, BARRIER_SEVERITY_DOMAIN.keys(), count).astype(
+        "uint8"
+    )
+    df["PotentialProject"] = choice(
+        rng, ["", "Severe Barrier", "Moderate Barrier", "Minor Barrier"], count
+    )
+
+    return df.sort_values(by="HUC12", kind="mergesort")[["id"] + SB_API_FIELDS]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--rows", type=int, default=100000, help="number of dams and small barriers"
+    )
+    parser.add_argument(
+        "--out", default="data/benchmark", help="output directory (data/benchmark)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed (0)")
+    args = parser.parse_args()
+
+    start = time()
+
+    out_dir = Path(args.out)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    rng = np.random.default_rng(args.seed)
+
+    # number of HUC12s grows with number of barriers, up to number in the region
+    num_huc12s = int(min(max(args.rows // 60, 100), MAX_HUC12S))
+    units = generate_units(rng, num_huc12s)
+
+    for name, generate in (
+        ("dams", generate_dams),
+        ("small_barriers", generate_small_barriers),
+    ):
+        print("Generating {:,} {}...".format(args.rows, name))
+        df = generate(rng, units, args.rows)
+
+        df.reset_index(drop=True).to_feather(out_dir / "{}.feather".format(name))
+        write_store(df, out_dir / "{}.arrow".format(name))
+
+    print("Done in {:.2f}s".format(time() - start))
@@ -0,0 +1,263 @@
+"""
+Benchmark the API endpoints against a data directory, e.g., created by
+`api/benchmark/generate_data.py`.
+
+Requests are drawn from a representative mix of query, counts, rank, and
+download requests for summary units of each layer, with and without filters,
+and run through the Flask test client.  The result cache is disabled unless
+`--cache` is used, so that each request is calculated.
+
+Reports latency (p50, p95, p99) and throughput for each kind of request and
+overall, and peak RSS of the process.  Results can be saved to JSON with
+`--output` to compare against later runs.
+
+To run:
+`python -m api.benchmark.run_benchmark --data data/benchmark --requests 500`
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import resource
+import sys
+from time import perf_counter
+
+import numpy as np
+
+
+# Relative frequency of each kind of request.
+# Values are (weight, barrier type, endpoint, layer, number of units, query parameters)
+REQUEST_MIX = [
+    # initial selection of units in the UI
+    (15, "dams", "query", "HUC8", 1, ""),
+    (10, "dams", "query", "State", 1, ""),
+    (5, "barriers", "query", "HUC8", 3, ""),
+    (5, "barriers", "query", "County", 2, ""),
+    # filter counts
+    (10, "dams", "counts", "State", 1, "heightclass=1,2"),
+    (5, "barriers", "counts", "HUC8", 2, "severityclass=2,3"),
+    # ranking
+    (12, "dams", "rank", "HUC8", 1, ""),
+    (8, "dams", "rank", "State", 1, "heightclass=1,2&gainmilesclass=2,3,4,5"),
+    (5, "dams", "rank", "HUC6", 2, "feasibility=0,3,4"),
+    (5, "barriers", "rank", "State", 1, "severityclass=2,3"),
+    (3, "dams", "rank", "HUC8", 2, "weights=gainmiles:0.5,tespp:0.5"),
+    # downloads
+    (6, "dams", "csv", "HUC8", 1, "custom=1"),
+    (3, "dams", "csv", "State", 1, "custom=1&unranked=1"),
+    (4, "barriers", "csv", "HUC8", 2, ""),
+    (4, "barriers", "csv", "County", 1, "custom=1"),
+]
+
+# fields used to select units for each layer
+LAYER_FIELDS = {
+    "HUC6": "HUC6",
+    "HUC8": "HUC8",
+    "State": "State",
+    "County": "COUNTYFIPS",
+}
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if len(values) else float("nan")
+
+
+def get_peak_rss():
+    """Return peak resident set size of this process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KB elsewhere
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def build_requests(snapshot, count, rng):
+    """Build a list of request URLs according to REQUEST_MIX.
+
+    Units are selected in proportion to the number of barriers they contain,
+    as is the case for real requests.
+
+    Parameters
+    ----------
+    snapshot : api.lib.data.Snapshot
+    count : int
+        number of requests
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    list of (kind, url)
+    """
+    weights = np.array([entry[0] for entry in REQUEST_MIX], dtype="float")
+    entries = rng.choice(len(REQUEST_MIX), size=count, p=weights / weights.sum())
+
+    requests = []
+    for i in entries:
+        _, barrier_type, endpoint, layer, num_units, params = REQUEST_MIX[i]
+        df = snapshot.get(barrier_type).df
+
+        units = df[LAYER_FIELDS[layer]].values
+        ids = np.unique(units[rng.integers(0, len(units), num_units)])
+
+        url = "/api/v1/{0}/{1}/{2}?id={3}".format(
+            barrier_type, endpoint, layer, ",".join(ids)
+        )
+        if params:
+            url += "&" + params
+
+        requests.append(("{0} {1}".format(barrier_type, endpoint), url))
+
+    return requests
+
+
+def run_request(client, url):
+    """Run request and read the full response body.
+
+    Returns
+    -------
+    tuple of (status code, duration in seconds, size of response in bytes)
+    """
+    start = perf_counter()
+    response = client.get(url)
+    size = len(response.get_data())
+    return response.status_code, perf_counter() - start, size
+
+
+def summarize(durations, elapsed):
+    return {
+        "requests": len(durations),
+        "p50_ms": percentile(durations, 50),
+        "p95_ms": percentile(durations, 95),
+        "p99_ms": percentile(durations, 99),
+        "throughput_rps": len(durations) / elapsed if elapsed else float("nan"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--data", default="data/benchmark", help="data directory (data/benchmark)"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=500, help="number of requests (500)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="number of concurrent clients (1)"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="number of untimed requests (20)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed (0)")
+    parser.add_argument(
+        "--cache", action="store_true", help="use the result cache of the API"
+    )
+    parser.add_argument("--output", help="path of JSON file to save results")
+    args = parser.parse_args()
+
+    # the API is configured when it is imported
+    os.environ["API_DATA_DIR"] = args.data
+    os.environ["API_RELOAD_INTERVAL"] = "0"
+    if not args.cache:
+        os.environ["API_CACHE_SIZE"] = "0"
+
+    load_start = perf_counter()
+    from api import server
+
+    if server.snapshot is None:
+        sys.exit("ERROR: not able to load data from {}".format(args.data))
+
+    load_time = perf_counter() - load_start
+    rss_loaded = get_peak_rss()
+
+    rng = np.random.default_rng(args.seed)
+    warmup = build_requests(server.snapshot, args.warmup, rng)
+    requests = build_requests(server.snapshot, args.requests, rng)
+
+    client = server.app.test_client()
+    for _, url in warmup:
+        run_request(client, url)
+
+    print(
+        "Running {:,} requests with {} concurrent clients...".format(
+            len(requests), args.concurrency
+        )
+    )
+
+    def run(request):
+        kind, url = request
+        status, duration, size = run_request(server.app.test_client(), url)
+        return kind, url, status, duration, size
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(run, requests))
+    elapsed = perf_counter() - start
+
+    errors = [(url, status) for _, url, status, _, _ in results if status != 200]
+
+    kinds = sorted(set(kind for kind, _ in requests))
+    summary = {
+        "data": args.data,
+        "rows": {
+            "dams": len(server.snapshot.dams.df),
+            "barriers": len(server.snapshot.barriers.df),
+        },
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "load_s": load_time,
+        "errors": len(errors),
+        "peak_rss_loaded_mb": rss_loaded,
+        "peak_rss_mb": get_peak_rss(),
+        "overall": summarize([r[3] for r in results], elapsed),
+        "kinds": {},
+    }
+    for kind in kinds:
+        kind_results = [r for r in results if r[0] == kind]
+        durations = [r[3] for r in kind_results]
+        summary["kinds"][kind] = summarize(durations, elapsed)
+        summary["kinds"][kind]["mean_bytes"] = float(
+            np.mean([r[4] for r in kind_results])
+        )
+
+    ### Report results
+    print(
+        "\nData: {0} ({1:,} dams, {2:,} barriers), loaded in {3:.2f}s".format(
+            args.data, summary["rows"]["dams"], summary["rows"]["barriers"], load_time
+        )
+    )
+    print(
+        "\n{:<18}{:>9}{:>10}{:>10}{:>10}{:>11}{:>12}".format(
+            "request", "count", "p50 ms", "p95 ms", "p99 ms", "req/s", "KB"
+        )
+    )
+    for kind, stats in list(summary["kinds"].items()) + [
+        ("overall", summary["overall"])
+    ]:
+        print(
+            "{:<18}{:>9,}{:>10.1f}{:>10.1f}{:>10.1f}{:>11.1f}{:>12}".format(
+                kind,
+                stats["requests"],
+                stats["p50_ms"],
+                stats["p95_ms"],
+                stats["p99_ms"],
+                stats["throughput_rps"],
+                "{:,.0f}".format(stats["mean_bytes"] / 1000)
+                if "mean_bytes" in stats
+                else "",
+            )
+        )
+
+    print(
+        "\nPeak RSS: {0:,.0f} MB after loading data, {1:,.0f} MB after requests".format(
+            summary["peak_rss_loaded_mb"], summary["peak_rss_mb"]
+        )
+    )
+
+    if errors:
+        print("\n{:,} requests failed, including:".format(len(errors)))
+        for url, status in errors[:10]:
+            print("{0} {1}".format(status, url))
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(summary, out, indent=2)
@@ -24,6 +24,12 @@ def unique(items):
 # Summary unit fields
 UNIT_FIELDS = ["HUC6", "HUC8", "HUC12", "State", "County", "ECO3", "ECO4"]
 
+# Summary unit layers that can be used to select barriers in the API
+LAYERS = ("HUC6", "HUC8", "HUC12", "State", "County", "ECO3", "ECO4")
+
+# fields used to select barriers for each of LAYERS
+LAYER_FIELDS = ("HUC6", "HUC8", "HUC12", "State", "COUNTYFIPS", "ECO3", "ECO4")
+
 # metric fields that are only valid for barriers with networks
 METRIC_FIELDS = [
     "StreamOrder",
@@ -50,6 +56,9 @@ TIER_FIELDS = [
 # Only present when custom prioritization is performed
 CUSTOM_TIER_FIELDS = ["NC_tier", "WC_tier", "NCWC_tier"]
 
+# Only present when custom prioritization is performed with user-defined weights
+CUSTOM_WEIGHT_TIER_FIELDS = ["CUSTOM_tier"]
+
 
 FILTER_FIELDS = [
     "SizeClasses",
@@ -129,6 +138,7 @@ DAM_EXPORT_FIELDS = (
     + METRIC_FIELDS
     + TIER_FIELDS
     + CUSTOM_TIER_FIELDS
+    + CUSTOM_WEIGHT_TIER_FIELDS
 )
 # remove recon
 DAM_EXPORT_FIELDS.remove("Recon")
@@ -182,6 +192,7 @@ SB_EXPORT_FIELDS = (
     + METRIC_FIELDS
     + TIER_FIELDS
     + CUSTOM_TIER_FIELDS
+    + CUSTOM_WEIGHT_TIER_FIELDS
 )
 
 SB_EXPORT_FIELDS = unique(SB_EXPORT_FIELDS)
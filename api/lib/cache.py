@@ -0,0 +1,351 @@
+from collections import OrderedDict
+import os
+import sys
+import tempfile
+from threading import Condition, Event, Lock, Thread
+
+import pandas as pd
+
+
+def get_size(value):
+    """Estimate the size in bytes of a cached value.
+
+    Parameters
+    ----------
+    value : pandas.DataFrame, pandas.Series, bytes, or tuple of these
+
+    Returns
+    -------
+    int
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(index=True, deep=True).sum())
+
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+
+    if isinstance(value, tuple):
+        return sum(get_size(v) for v in value)
+
+    return sys.getsizeof(value)
+
+
+class ResultCache(object):
+    """Least recently used cache of results, bounded by the total size in bytes
+    of the cached values.
+
+    Cached values must be treated as read-only by the caller.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of cached values.  Values larger than this are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Get value from cache, or None if not present.
+
+        Parameters
+        ----------
+        key : hashable
+
+        Returns
+        -------
+        cached value or None
+        """
+        with self._lock:
+            item = self._items.get(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        """Add value to cache, evicting the least recently used values if needed.
+
+        Parameters
+        ----------
+        key : hashable
+        value : any
+        """
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+
+            while self._items and self.bytes + size > self.max_bytes:
+                self.bytes -= self._items.popitem(last=False)[1][1]
+
+            self._items[key] = (value, size)
+            self.bytes += size
+
+    def clear(self):
+        """Remove all values from the cache, e.g., when the underlying data change."""
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return cache statistics.
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calculations of the same result.
+
+    While a calculation for a key is running, other calls for the same key wait
+    for it to complete and share its result (or its exception), instead of
+    repeating the calculation.  Results are not kept once the calculation is
+    complete; use ResultCache for that.
+
+    Shared results must be treated as read-only by the caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._running = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._running)
+
+    def do(self, key, func):
+        """Call func, or wait for the result of the call already running for key.
+
+        Parameters
+        ----------
+        key : hashable
+        func : callable
+            called without arguments
+
+        Returns
+        -------
+        result of func
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._running.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._running[key] = {"done": Event()}
+            else:
+                self.shared += 1
+
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+
+            return call["result"]
+
+        try:
+            call["result"] = func()
+            return call["result"]
+
+        except BaseException as ex:
+            call["error"] = ex
+            raise
+
+        finally:
+            with self._lock:
+                del self._running[key]
+            call["done"].set()
+
+    def stats(self):
+        """Return statistics of calls.
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            "running": len(self._running),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
+
+
+class Spool(object):
+    """Anonymous temporary file that is read while it is being written.
+
+    Parameters
+    ----------
+    dir : str, optional (default: None)
+        directory for the file; defaults to the system temporary directory
+    """
+
+    def __init__(self, dir=None):
+        self.file = tempfile.TemporaryFile(dir=dir)
+        self.size = 0
+        self.done = False
+        self.error = None
+        self._changed = Condition()
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+        with self._changed:
+            self.size += len(data)
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        """Mark the file as complete, or as failed with error."""
+        with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    def read(self, chunk_size):
+        """Read the file from the start, waiting for data as they are written.
+
+        Parameters
+        ----------
+        chunk_size : int
+            maximum number of bytes per chunk
+
+        Yields
+        ------
+        bytes
+        """
+        offset = 0
+        while True:
+            with self._changed:
+                while offset >= self.size and not self.done:
+                    self._changed.wait()
+
+                size = self.size
+
+            if offset < size:
+                data = os.pread(
+                    self.file.fileno(), min(size - offset, chunk_size), offset
+                )
+                offset += len(data)
+                yield data
+
+            elif self.error is not None:
+                raise self.error
+
+            else:
+                return
+
+
+class SharedStreams(object):
+    """Coalesce concurrent streams of the same response.
+
+    The first call for a key starts a thread that writes the chunks of the
+    response to a spool file.  It and all other calls for the same key while the
+    file is being written stream the response from the file as it grows, so that
+    the response is only produced once and memory use is bounded by the size of
+    chunks.  The file is removed once it is no longer read.
+
+    Parameters
+    ----------
+    dir : str, optional (default: None)
+        directory for spool files; defaults to the system temporary directory
+    chunk_size : int, optional (default: 1 MB)
+        maximum number of bytes per chunk read from spool files
+    """
+
+    def __init__(self, dir=None, chunk_size=1000000):
+        self.dir = dir
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.shared = 0
+        self._running = {}
+        self._lock = Lock()
+
+    def stream(self, key, func):
+        """Stream the response for key, producing it using func unless it is
+        already being produced.
+
+        Parameters
+        ----------
+        key : hashable
+        func : callable
+            called without arguments in the calling thread; returns an iterable
+            of bytes, which is iterated in a separate thread
+
+        Returns
+        -------
+        iterable of bytes
+        """
+        with self._lock:
+            self.calls += 1
+            spool = self._running.get(key, None)
+            leader = spool is None
+            if leader:
+                spool = self._running[key] = Spool(self.dir)
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                chunks = func()
+
+            except BaseException as ex:
+                self._finish(key, spool, ex)
+                raise
+
+            Thread(target=self._write, args=(key, spool, chunks), daemon=True).start()
+
+        return spool.read(self.chunk_size)
+
+    def _write(self, key, spool, chunks):
+        try:
+            for chunk in chunks:
+                spool.write(chunk)
+
+        except Exception as ex:
+            self._finish(key, spool, ex)
+
+        else:
+            self._finish(key, spool)
+
+    def _finish(self, key, spool, error=None):
+        with self._lock:
+            del self._running[key]
+
+        spool.finish(error)
+
+    def stats(self):
+        """Return statistics of streams.
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            "running": len(self._running),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
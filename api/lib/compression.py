@@ -0,0 +1,66 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; responses are only compressed with gzip
+    brotli = None
+
+
+# High compression levels are used because responses are compressed once and
+# then served from the result cache.  Brotli quality 11 is much slower for a
+# small improvement in size.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Responses smaller than this are not compressed
+MIN_SIZE = 1000
+
+# Encodings in order of preference when a client accepts several equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def get_encoding(accept_encodings, size):
+    """Select the content encoding to use for a response based on the
+    Accept-Encoding header of the request.
+
+    Parameters
+    ----------
+    accept_encodings : werkzeug.datastructures.Accept
+        encodings accepted by the client
+    size : int
+        size of the uncompressed response in bytes
+
+    Returns
+    -------
+    str or None
+        one of ENCODINGS, or None if the response should not be compressed
+    """
+    if size < MIN_SIZE:
+        return None
+
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    """Compress body using encoding.
+
+    Output of gzip does not include a timestamp, so that it is the same for
+    the same body.
+
+    Parameters
+    ----------
+    body : bytes
+    encoding : str
+        one of ENCODINGS
+
+    Returns
+    -------
+    bytes
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+    raise ValueError("encoding is not supported: {}".format(encoding))
@@ -0,0 +1,206 @@
+import hashlib
+from threading import Thread
+from time import sleep
+import warnings
+
+from api.lib.domains import decode_domains
+from api.lib.filters import BitmapIndex
+from api.lib.formats import CSVRows
+from api.lib.index import UnitIndex
+from api.lib.spatial import GridIndex
+from api.lib.store import (
+    get_file_version,
+    get_store_path,
+    read_store,
+    read_table,
+    read_table_metadata,
+)
+from api.lib.tiers import UnitTiers
+
+
+class BarrierData(object):
+    """Data and indexes for a single barrier type.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        data indexed on id and sorted by HUC12
+    layer_fields : list-like
+        fields used to select summary units
+    filter_fields : list-like
+        fields used to filter records
+    domains : dict
+        mapping of field name to domain of fields decoded for download
+    unit_tiers : pandas.DataFrame, optional (default: None)
+        custom tiers precomputed for each summary unit
+    """
+
+    def __init__(self, df, layer_fields, filter_fields, domains, unit_tiers=None):
+        self.df = df
+        self.index = UnitIndex(df, layer_fields)
+        self.spatial = GridIndex(df.lon.values, df.lat.values)
+        self.filters = BitmapIndex(df, filter_fields)
+        self.decoded = decode_domains(df, domains)
+        # CSV of filter fields, which are returned by query
+        self.csv_rows = CSVRows(df[filter_fields])
+        self.unit_tiers = None if unit_tiers is None else UnitTiers(df, unit_tiers)
+
+
+class Snapshot(object):
+    """Immutable snapshot of all data used by the API at a given data version.
+
+    Requests must get the current snapshot once and use it throughout, so that
+    they complete against the same data even if a new snapshot is swapped in.
+
+    Parameters
+    ----------
+    version : str
+    dams : BarrierData
+    barriers : BarrierData
+    """
+
+    def __init__(self, version, dams, barriers):
+        self.version = version
+        self.dams = dams
+        self.barriers = barriers
+
+    def get(self, barrier_type):
+        return self.dams if barrier_type == "dams" else self.barriers
+
+
+def get_unit_tiers_path(data_dir, name):
+    return data_dir / "{}_unit_tiers.arrow".format(name)
+
+
+def get_data_version(data_dir, names):
+    """Calculate data version based on the modification time and size of each
+    data file, including precomputed tiers if present.
+
+    Parameters
+    ----------
+    data_dir : pathlib.Path
+    names : list-like
+        base names of data files, e.g., "dams"
+
+    Returns
+    -------
+    str
+    """
+    paths = []
+    for name in names:
+        paths.append(get_store_path(data_dir, name))
+
+        tiers_path = get_unit_tiers_path(data_dir, name)
+        if tiers_path.exists():
+            paths.append(tiers_path)
+
+    hash = hashlib.sha1()
+    for path in paths:
+        hash.update(get_file_version(path).encode("utf-8"))
+
+    return hash.hexdigest()[:16]
+
+
+def load_barrier_data(data_dir, name, fields, layer_fields, filter_fields, domains):
+    """Read and validate data for a barrier type, and build indexes.
+
+    Parameters
+    ----------
+    data_dir : pathlib.Path
+    name : str
+        base name of data file, e.g., "dams"
+    fields : list-like
+        fields that must be present in data
+    layer_fields : list-like
+        fields used to select summary units
+    filter_fields : list-like
+        fields used to filter records
+    domains : dict
+        mapping of field name to domain of fields decoded for download
+
+    Raises
+    ------
+    ValueError
+        raised if data are missing any of fields, or precomputed tiers do not
+        match data
+
+    Returns
+    -------
+    BarrierData
+    """
+    df = read_store(data_dir, name)
+
+    missing = [f for f in fields if not (f in df.columns or f == df.index.name)]
+    if missing:
+        raise ValueError(
+            "{0} data are missing fields: {1}".format(name, ", ".join(missing))
+        )
+
+    # precomputed tiers are only used if they were calculated from this version
+    # of the data file; otherwise tiers are calculated for each request
+    unit_tiers = None
+    tiers_path = get_unit_tiers_path(data_dir, name)
+    if tiers_path.exists():
+        source = read_table_metadata(tiers_path).get("source", None)
+        if source == get_file_version(get_store_path(data_dir, name)):
+            unit_tiers = read_table(tiers_path)
+        else:
+            warnings.warn(
+                "{} does not match the current data file and is not used; rerun "
+                "analysis/rank/precompute_unit_tiers.py".format(tiers_path.name)
+            )
+
+    return BarrierData(df, layer_fields, filter_fields, domains, unit_tiers)
+
+
+class DataWatcher(Thread):
+    """Background thread that checks for a new data version at a regular interval
+    and calls on_change when it is found.
+
+    The data version must be unchanged between two consecutive checks before
+    on_change is called, so that files are not read while being written.  If
+    on_change fails for a version, it is not retried until the version changes.
+
+    Parameters
+    ----------
+    get_version : callable
+        returns the current version of the data files
+    get_loaded_version : callable
+        returns the version of the data currently in use
+    on_change : callable
+        called with the new version; returns False if the new version could not
+        be loaded.  Exceptions must be handled by on_change.
+    interval : int
+        number of seconds between checks
+    """
+
+    def __init__(self, get_version, get_loaded_version, on_change, interval):
+        super().__init__(daemon=True)
+        self.get_version = get_version
+        self.get_loaded_version = get_loaded_version
+        self.on_change = on_change
+        self.interval = interval
+
+    def run(self):
+        pending = None
+        failed = None
+        while True:
+            sleep(self.interval)
+
+            try:
+                version = self.get_version()
+            except OSError:
+                # files are being replaced
+                pending = None
+                continue
+
+            if version == self.get_loaded_version() or version == failed:
+                pending = None
+
+            elif version == pending:
+                if self.on_change(version) is False:
+                    failed = version
+                pending = None
+
+            else:
+                pending = version
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+
+def to_categorical(series, domain):
+    """Decode coded values in series to a categorical of their labels in domain.
+
+    Where the codes are 0...n-1, the values of series are used as the categorical
+    codes without looking them up in domain; they are still copied to the
+    smallest integer type that holds the codes (e.g., int8).  Values not present
+    in domain are decoded to null.
+
+    Parameters
+    ----------
+    series : pandas.Series
+        integer or boolean codes
+    domain : dict
+        mapping of code to label
+
+    Returns
+    -------
+    pandas.Series
+    """
+    keys = np.array(sorted(domain.keys()))
+    categories = [domain[key] for key in keys]
+    values = series.values
+
+    if values.dtype == "bool":
+        values = values.view("int8")
+
+    if (
+        np.array_equal(keys, np.arange(len(keys)))
+        and values.dtype.kind in "iu"
+        and (len(values) == 0 or (values.min() >= 0 and values.max() < len(keys)))
+    ):
+        codes = values
+
+    else:
+        idx = np.minimum(keys.searchsorted(values), len(keys) - 1)
+        codes = np.where(keys[idx] == values, idx, -1)
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def decode_domains(df, domains):
+    """Decode coded fields in data frame to categoricals of their labels.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    domains : dict
+        mapping of field name to domain
+
+    Returns
+    -------
+    pandas.DataFrame
+        decoded fields, with the same index as df
+    """
+    return pd.DataFrame(
+        {field: to_categorical(df[field], domain) for field, domain in domains.items()},
+        index=df.index,
+    )
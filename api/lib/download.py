@@ -0,0 +1,93 @@
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+# Number of rows serialized to CSV at a time
+CSV_CHUNK_SIZE = 10000
+
+
+class StreamBuffer(object):
+    """Write-only, non-seekable file-like object that accumulates bytes written
+    to it until they are drained.
+
+    ZipFile writes to this using data descriptors after each file, since it cannot
+    seek back to update local file headers.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return all bytes written since the last call and reset the buffer.
+
+        Returns
+        -------
+        bytes
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_csv(df, chunk_size=CSV_CHUNK_SIZE, **kwargs):
+    """Serialize data frame to CSV in chunks of rows.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    chunk_size : int, optional (default: CSV_CHUNK_SIZE)
+        number of rows per chunk
+    **kwargs
+        passed to DataFrame.to_csv()
+
+    Yields
+    ------
+    bytes
+        UTF-8 encoded CSV; the first chunk includes the header
+    """
+    # always write at least the header
+    for start in range(0, max(len(df), 1), chunk_size):
+        yield df.iloc[start : start + chunk_size].to_csv(
+            header=start == 0, **kwargs
+        ).encode("utf-8")
+
+
+def stream_zip(files):
+    """Create a zip file incrementally from files, yielding bytes of the zip file
+    as they are written.
+
+    Only a single chunk of each file is held in memory at a time.
+
+    Parameters
+    ----------
+    files : list of (filename, iterable of bytes)
+
+    Yields
+    ------
+    bytes
+    """
+    buffer = StreamBuffer()
+    zf = ZipFile(buffer, "w", compression=ZIP_DEFLATED)
+
+    for filename, chunks in files:
+        with zf.open(filename, "w", force_zip64=True) as out:
+            for chunk in chunks:
+                out.write(chunk)
+
+                data = buffer.drain()
+                if data:
+                    yield data
+
+        # write remaining compressed data and data descriptor
+        yield buffer.drain()
+
+    zf.close()
+
+    # central directory
+    yield buffer.drain()
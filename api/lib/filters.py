@@ -0,0 +1,140 @@
+import numpy as np
+
+
+class BitmapIndex(object):
+    """Index of packed bitmaps for each value of each filter field.
+
+    Filter fields are small integer domains, so there are few bitmaps per field.
+    Filters are evaluated using bitwise OR of the bitmaps for the selected values
+    within a field, and bitwise AND across fields.
+
+    The values of each field are also stored as codes into the unique values of
+    that field, so that records can be counted for each value using bincount.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    fields : list-like
+        Columns in df to index.  Must be integer or boolean.
+    """
+
+    def __init__(self, df, fields):
+        self.size = len(df)
+        self.nbytes = (self.size + 7) // 8
+        self.bitmaps = {}
+        self.values = {}
+        self.codes = {}
+
+        for field in fields:
+            values = df[field].values
+            unique, codes = np.unique(values, return_inverse=True)
+            self.bitmaps[field] = {
+                int(value): np.packbits(values == value) for value in unique
+            }
+            self.values[field] = [int(value) for value in unique]
+            self.codes[field] = codes.astype(
+                "uint8" if len(unique) <= 256 else "uint32"
+            )
+
+    def mask(self, filters):
+        """Calculate packed bitmap of records that meet all filters.
+
+        Parameters
+        ----------
+        filters : dict
+            Mapping of field name to list of values to include.
+
+        Returns
+        -------
+        ndarray of packed bits (uint8) or None if there are no filters
+        """
+        result = None
+
+        for field, values in filters.items():
+            bitmaps = self.bitmaps[field]
+            field_mask = np.zeros(self.nbytes, dtype="uint8")
+            for value in values:
+                if value in bitmaps:
+                    np.bitwise_or(field_mask, bitmaps[value], out=field_mask)
+
+            if result is None:
+                result = field_mask
+            else:
+                np.bitwise_and(result, field_mask, out=result)
+
+        return result
+
+    def select(self, positions, filters):
+        """Select the subset of row positions that meet all filters.
+
+        Parameters
+        ----------
+        positions : ndarray
+            row positions
+        filters : dict
+            Mapping of field name to list of values to include.
+
+        Returns
+        -------
+        ndarray of row positions
+        """
+        mask = self.mask(filters)
+        if mask is None:
+            return positions
+
+        return positions[get_bits(mask, positions)]
+
+    def counts(self, positions, filters):
+        """Count records for each value of each field.
+
+        Following the crossfilter convention, records counted for a field must
+        meet the filters of all other fields, but not the filter of that field.
+
+        Parameters
+        ----------
+        positions : ndarray
+            row positions
+        filters : dict
+            Mapping of field name to list of values to include.
+
+        Returns
+        -------
+        dict
+            Mapping of field name to dict of value to count.
+        """
+        # records at positions that meet the filter of each field
+        included = {
+            field: get_bits(self.mask({field: values}), positions)
+            for field, values in filters.items()
+        }
+
+        results = {}
+        for field, codes in self.codes.items():
+            include = None
+            for other, bits in included.items():
+                if other != field:
+                    include = bits if include is None else include & bits
+
+            selected = positions if include is None else positions[include]
+            counts = np.bincount(codes[selected], minlength=len(self.values[field]))
+            results[field] = dict(zip(self.values[field], counts.tolist()))
+
+        return results
+
+
+def get_bits(mask, positions):
+    """Extract the bit for each position from a packed bitmap.
+
+    Parameters
+    ----------
+    mask : ndarray of packed bits (uint8)
+    positions : ndarray
+        row positions
+
+    Returns
+    -------
+    ndarray of bool
+    """
+    # bits are packed in big-endian order
+    bits = (mask[positions >> 3] >> (7 - (positions & 7))) & 1
+    return bits.astype("bool")
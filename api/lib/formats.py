@@ -0,0 +1,124 @@
+import numpy as np
+import pyarrow as pa
+
+
+CSV_MIMETYPE = "text/csv"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# response formats available for query and rank endpoints
+RESPONSE_FORMATS = {"csv": CSV_MIMETYPE, "arrow": ARROW_MIMETYPE}
+
+
+def to_csv(df):
+    """Serialize data frame to CSV, including index as id and lowercased column names.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+
+    Returns
+    -------
+    bytes
+    """
+    return df.to_csv(index_label="id", header=[c.lower() for c in df.columns]).encode(
+        "utf-8"
+    )
+
+
+class CSVRows(object):
+    """Rows of a data frame serialized to CSV in advance, so that CSV for any
+    subset of rows can be assembled by copying bytes instead of formatting values.
+
+    CSV of all rows is stored as a single buffer, with the offset of the start
+    of each row.  Output is the same as to_csv() for the same rows.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        values must not contain line breaks
+    """
+
+    def __init__(self, df):
+        csv = to_csv(df)
+        header_end = csv.index(b"\n") + 1
+        self.header = csv[:header_end]
+        self.buffer = memoryview(csv)[header_end:]
+
+        ends = np.flatnonzero(np.frombuffer(self.buffer, dtype="uint8") == ord("\n"))
+        if len(ends) != len(df):
+            raise ValueError("values must not contain line breaks")
+
+        self.offsets = np.zeros(len(df) + 1, dtype="int64")
+        self.offsets[1:] = ends + 1
+
+    def get(self, positions):
+        """Get CSV of rows at positions, including the header.
+
+        Rows at consecutive positions (e.g., HUCs selected from data sorted by
+        HUC) are copied as a single slice of the buffer.
+
+        Parameters
+        ----------
+        positions : ndarray of int
+            row positions, in the order they are returned
+
+        Returns
+        -------
+        bytes
+        """
+        if len(positions) == 0:
+            return self.header
+
+        # split positions into runs of consecutive positions
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        starts = self.offsets[positions[np.insert(breaks, 0, 0)]]
+        ends = self.offsets[positions[np.append(breaks - 1, len(positions) - 1)] + 1]
+
+        chunks = [self.header]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            chunks.append(self.buffer[start:end])
+
+        return b"".join(chunks)
+
+
+def to_arrow(df):
+    """Serialize data frame to an Arrow IPC stream, including index as id and
+    lowercased column names.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+
+    Returns
+    -------
+    bytes
+    """
+    df = df.reset_index()
+    df.columns = ["id"] + [c.lower() for c in df.columns[1:]]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+
+    return sink.getvalue().to_pybytes()
+
+
+def serialize(df, format="csv"):
+    """Serialize data frame to the response format.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    format : str, optional (default: "csv")
+        one of RESPONSE_FORMATS
+
+    Returns
+    -------
+    bytes
+    """
+    if format == "arrow":
+        return to_arrow(df)
+
+    return to_csv(df)
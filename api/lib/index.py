@@ -0,0 +1,86 @@
+import numpy as np
+
+
+# HUC codes are hierarchical: each HUC6 / HUC8 code is a prefix of the HUC12
+# codes within it.  If the data are sorted by HUC12, all records for a given
+# HUC at any of these levels are contiguous.
+HUC_LAYERS = ("HUC6", "HUC8", "HUC12")
+
+EMPTY = np.array([], dtype="int64")
+
+
+class UnitIndex(object):
+    """Index of the row positions of each summary unit within a data frame.
+
+    HUC layers are resolved using binary search against the sorted values of
+    each HUC column (data frame must be sorted by HUC12).  All other layers
+    (State, County, ECO3, ECO4) use precomputed arrays of row positions for each unit.
+
+    Selecting units is proportional to the number of rows returned, not the size
+    of the data frame.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Data frame sorted by HUC12.
+    layers : list-like
+        Columns in df to index.
+    """
+
+    def __init__(self, df, layers):
+        self.size = len(df)
+        self.sorted = {}
+        self.positions = {}
+
+        for layer in layers:
+            values = df[layer]
+
+            # fall back to position lists if HUCs are incomplete or data are unsorted
+            if (
+                layer in HUC_LAYERS
+                and not values.isnull().any()
+                and values.is_monotonic_increasing
+            ):
+                # fixed-width byte strings are compact and fast to search
+                # (HUC codes are ASCII digits)
+                self.sorted[layer] = np.asarray(values).astype("S")
+
+            else:
+                self.positions[layer] = df.groupby(layer).indices
+
+    def select(self, layer, ids):
+        """Select row positions of all records within ids in layer.
+
+        Parameters
+        ----------
+        layer : str
+            Name of indexed column
+        ids : list-like
+            Unit IDs to select
+
+        Returns
+        -------
+        ndarray of row positions, in ascending order
+        """
+        ids = sorted(set(ids))
+
+        if layer in self.sorted:
+            values = self.sorted[layer]
+            ids = np.array([str(id).encode("utf-8") for id in ids], dtype="S")
+            left = values.searchsorted(ids, side="left")
+            right = values.searchsorted(ids, side="right")
+
+            # ids are sorted, so slices are in ascending order and do not overlap
+            slices = [np.arange(l, r) for l, r in zip(left, right) if r > l]
+
+            return np.concatenate(slices) if slices else EMPTY
+
+        lut = self.positions[layer]
+        positions = [lut[id] for id in ids if id in lut]
+        if not positions:
+            return EMPTY
+
+        if len(positions) == 1:
+            return positions[0]
+
+        return np.sort(np.concatenate(positions))
@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+from threading import Lock
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# Partial files that have not been written to for this many seconds are
+# considered abandoned, e.g., if the process building them stopped
+STALE_SECONDS = 600
+
+# Subdirectory of the export directory that contains the files of jobs
+JOBS_DIR = "jobs"
+
+# Names of directories of data versions; see api.lib.data.get_data_version()
+VERSION = re.compile(r"^[0-9a-f]{16}$")
+
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+
+
+class ExportJobs(object):
+    """Build export files in the background using a pool of worker threads.
+
+    Files are stored in a directory for each data version within the JOBS_DIR
+    subdirectory of path, named by the id of the job, which identifies the
+    content of the file (e.g., a hash of the normalized request).  Finished files
+    are reused by later jobs with the same id until the data version changes.
+
+    The status of a job is determined from the files in the directory, so that
+    it is shared by all processes of the API:
+    * <id>.zip: complete
+    * <id>.part: running; renamed to <id>.zip once complete
+    * <id>.error: failed; contains the error message
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        directory for export files; only its JOBS_DIR subdirectory is used
+    max_workers : int, optional (default: 2)
+        maximum number of jobs run at the same time by this process
+    """
+
+    def __init__(self, path, max_workers=2):
+        self.path = Path(path) / JOBS_DIR
+        self.max_workers = max_workers
+        self._pool = None
+        self._running = set()
+        self._lock = Lock()
+
+    def get_path(self, version, id, suffix="zip"):
+        """Get path of a file for a job.
+
+        Parameters
+        ----------
+        version : str
+            data version
+        id : str
+            job id
+        suffix : str, optional (default: "zip")
+
+        Returns
+        -------
+        pathlib.Path
+        """
+        return self.path / version / "{0}.{1}".format(id, suffix)
+
+    def status(self, version, id):
+        """Get status of a job.
+
+        Parameters
+        ----------
+        version : str
+            data version
+        id : str
+            job id
+
+        Returns
+        -------
+        str or None
+            RUNNING, COMPLETE, or FAILED; None if job does not exist
+        """
+        if self.get_path(version, id).exists():
+            return COMPLETE
+
+        if (version, id) in self._running:
+            return RUNNING
+
+        try:
+            modified = self.get_path(version, id, "part").stat().st_mtime
+            if time.time() - modified < STALE_SECONDS:
+                return RUNNING
+
+        except FileNotFoundError:
+            pass
+
+        if self.get_path(version, id, "error").exists():
+            return FAILED
+
+        return None
+
+    def get_error(self, version, id):
+        """Get error message of a failed job.
+
+        Returns
+        -------
+        str or None
+        """
+        try:
+            return self.get_path(version, id, "error").read_text()
+
+        except FileNotFoundError:
+            return None
+
+    def submit(self, version, id, write):
+        """Start a job unless it is already running or complete.  Failed jobs are
+        started again.
+
+        Parameters
+        ----------
+        version : str
+            data version
+        id : str
+            job id
+        write : callable
+            called with a binary file object to write the contents of the file
+
+        Returns
+        -------
+        str
+            status of job
+        """
+        with self._lock:
+            status = self.status(version, id)
+            if status in (RUNNING, COMPLETE):
+                return status
+
+            part = self.get_path(version, id, "part")
+            part.parent.mkdir(parents=True, exist_ok=True)
+
+            # remove partial file abandoned by a stopped job
+            try:
+                if time.time() - part.stat().st_mtime >= STALE_SECONDS:
+                    part.unlink()
+            except FileNotFoundError:
+                pass
+
+            # mark job as running for other processes; only one process can
+            # create the file, others treat the job as running
+            try:
+                fd = os.open(part, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return RUNNING
+
+            self._running.add((version, id))
+
+            error = self.get_path(version, id, "error")
+            if error.exists():
+                error.unlink()
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        self._pool.submit(self._run, version, id, fd, write)
+        return RUNNING
+
+    def _run(self, version, id, fd, write):
+        part = self.get_path(version, id, "part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                write(out)
+
+            os.replace(part, self.get_path(version, id))
+
+        except Exception as ex:
+            log.exception("export {} failed".format(id))
+            try:
+                self.get_path(version, id, "error").write_text(str(ex))
+                part.unlink()
+
+            except OSError:
+                # directory was removed because the data version changed
+                pass
+
+        finally:
+            with self._lock:
+                self._running.discard((version, id))
+
+    def remove_stale(self, version):
+        """Remove files of data versions other than version.
+
+        Only directories named like data versions are removed, in case the
+        directory contains other files.
+
+        Parameters
+        ----------
+        version : str
+            data version in use
+        """
+        if not self.path.exists():
+            return
+
+        for path in self.path.iterdir():
+            if path.is_dir() and VERSION.match(path.name) and path.name != version:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,337 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+# Upper bounds of histogram buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+
+    return "{{{}}}".format(
+        ",".join(
+            '{0}="{1}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for name, value in zip(names, values)
+        )
+    )
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Base class for metrics with a fixed set of label names.
+
+    Parameters
+    ----------
+    name : str
+    help : str
+    labels : list-like, optional (default: None)
+        names of labels
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels or [])
+        self.lock = Lock()
+        self.values = {}
+
+    def get_key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        """Render metric in Prometheus text format.
+
+        Returns
+        -------
+        list of str
+            lines
+        """
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.help),
+            "# TYPE {0} {1}".format(self.name, self.type),
+        ]
+
+        with self.lock:
+            items = sorted(self.values.items())
+
+        for key, value in items:
+            lines.extend(self.render_value(key, value))
+
+        return lines
+
+    def render_value(self, key, value):
+        return [
+            "{0}{1} {2}".format(
+                self.name, format_labels(self.labels, key), format_value(value)
+            )
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class Histogram(Metric):
+    """Histogram of observed values in cumulative buckets.
+
+    Parameters
+    ----------
+    name : str
+    help : str
+    labels : list-like, optional (default: None)
+        names of labels
+    buckets : list-like, optional (default: DEFAULT_BUCKETS)
+        upper bounds of buckets, in increasing order
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def drain(self):
+        """Return observations made since the last call and reset the histogram.
+
+        Returns
+        -------
+        dict
+            mapping of label values to (bucket counts, sum)
+        """
+        with self.lock:
+            values = self.values
+            self.values = {}
+
+        return values
+
+    def merge(self, values):
+        """Add observations returned by drain() of the same histogram, e.g., in
+        another process.
+
+        Parameters
+        ----------
+        values : dict
+        """
+        with self.lock:
+            for key, (counts, total) in values.items():
+                current, current_total = self.values.get(
+                    key, ([0] * len(self.buckets), 0)
+                )
+                self.values[key] = (
+                    [a + b for a, b in zip(current, counts)],
+                    current_total + total,
+                )
+
+    def render_value(self, key, value):
+        counts, total = value
+        lines = [
+            "{0}_bucket{1} {2}".format(
+                self.name,
+                format_labels(self.labels + ("le",), key + (format_value(bound),)),
+                count,
+            )
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(
+            "{0}_sum{1} {2}".format(
+                self.name, format_labels(self.labels, key), format_value(total)
+            )
+        )
+        lines.append(
+            "{0}_count{1} {2}".format(
+                self.name, format_labels(self.labels, key), counts[-1]
+            )
+        )
+        return lines
+
+
+class Registry(object):
+    """Collection of metrics rendered together.
+
+    Metrics are kept in memory of each process, so each worker process reports
+    its own metrics.  Observations of histograms in other processes can be added
+    using drain() and merge().
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def drain(self):
+        """Return observations of all histograms made since the last call, and
+        reset them.
+
+        Returns
+        -------
+        dict
+            mapping of histogram name to observations; see Histogram.drain()
+        """
+        return {
+            metric.name: metric.drain()
+            for metric in self.metrics
+            if isinstance(metric, Histogram)
+        }
+
+    def merge(self, observations):
+        """Add observations returned by drain() of a registry with the same
+        metrics, e.g., in a worker process.
+
+        Parameters
+        ----------
+        observations : dict
+        """
+        for metric in self.metrics:
+            if metric.name in observations:
+                metric.merge(observations[metric.name])
+
+    def render(self):
+        """Render all metrics in Prometheus text format.
+
+        Returns
+        -------
+        str
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimer(object):
+    """Record the duration of each phase of a request.
+
+    Parameters
+    ----------
+    histogram : Histogram, optional (default: None)
+        if present, durations are also observed in this histogram, labeled by
+        endpoint and phase
+    endpoint : str, optional (default: "")
+    """
+
+    def __init__(self, histogram=None, endpoint=""):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.start = perf_counter()
+        self.phases = []
+
+    def record(self, phase, duration):
+        self.phases.append((phase, duration))
+        if self.histogram is not None:
+            self.histogram.observe(duration, endpoint=self.endpoint, phase=phase)
+
+    @contextmanager
+    def phase(self, phase):
+        """Time the enclosed block as phase."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, perf_counter() - start)
+
+    def iter(self, phase, iterable):
+        """Time the iteration over iterable as phase, e.g., for streamed responses.
+
+        Parameters
+        ----------
+        phase : str
+        iterable : iterable
+
+        Returns
+        -------
+        generator
+        """
+        duration = 0
+        try:
+            iterator = iter(iterable)
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    duration += perf_counter() - start
+
+                yield item
+
+        finally:
+            self.record(phase, duration)
+
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def get_header(self):
+        """Get value of Server-Timing header for phases recorded so far.
+
+        Returns
+        -------
+        str
+        """
+        entries = [
+            "{0};dur={1:.1f}".format(phase, duration * 1000)
+            for phase, duration in self.phases
+        ]
+        entries.append("total;dur={:.1f}".format(self.elapsed() * 1000))
+        return ", ".join(entries)
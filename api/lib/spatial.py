@@ -0,0 +1,452 @@
+import numpy as np
+
+from api.lib.index import EMPTY
+
+
+# Target average number of points in each cell of the grid
+POINTS_PER_CELL = 16
+
+# Maximum number of vertices of polygons used to select points
+MAX_VERTICES = 10000
+
+# Mean radius of the earth in miles
+EARTH_RADIUS = 3958.8
+
+
+class GridIndex(object):
+    """Packed grid index of point locations.
+
+    Points are assigned to cells of a regular grid over their extent.  Row
+    positions are stored sorted by cell, with the offset of the first position
+    of each cell, so that the cells within a row of the grid are a contiguous
+    range of positions.
+
+    Selecting points is proportional to the number of points in the cells that
+    are searched, not the number of points in the index.
+
+    Parameters
+    ----------
+    x : ndarray
+        longitude of each point
+    y : ndarray
+        latitude of each point
+    points_per_cell : int, optional (default: POINTS_PER_CELL)
+        target average number of points in each cell
+    """
+
+    def __init__(self, x, y, points_per_cell=POINTS_PER_CELL):
+        self.x = x
+        self.y = y
+        self.size = len(x)
+
+        # points without coordinates are never selected
+        valid = np.isfinite(x) & np.isfinite(y)
+        if valid.any():
+            xmin, ymin = x[valid].min(), y[valid].min()
+            xmax, ymax = x[valid].max(), y[valid].max()
+        else:
+            xmin, ymin, xmax, ymax = 0, 0, 1, 1
+
+        # used to bound distances to points in cells that have not been searched
+        self.max_abs_y = max(abs(float(ymin)), abs(float(ymax)))
+
+        width = max(float(xmax - xmin), 1e-6)
+        height = max(float(ymax - ymin), 1e-6)
+
+        # square cells, sized so that cells contain points_per_cell on average
+        num_cells = max(self.size // points_per_cell, 1)
+        self.cell_size = np.sqrt(width * height / num_cells)
+        self.origin = (float(xmin), float(ymin))
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        cells = self.get_cells(x, y)
+        self.positions = np.argsort(cells, kind="stable").astype("uint32")
+        self.offsets = np.searchsorted(
+            cells[self.positions], np.arange(self.nx * self.ny + 1)
+        )
+
+    def get_cells(self, x, y):
+        ix, iy = self.get_col_row(x, y)
+        return iy * self.nx + ix
+
+    def get_col_row(self, x, y):
+        ix = (np.asarray(x, dtype="float64") - self.origin[0]) // self.cell_size
+        iy = (np.asarray(y, dtype="float64") - self.origin[1]) // self.cell_size
+        ix = np.clip(np.nan_to_num(ix), 0, self.nx - 1).astype("int64")
+        iy = np.clip(np.nan_to_num(iy), 0, self.ny - 1).astype("int64")
+        return ix, iy
+
+    def get_cell_range(self, xmin, ymin, xmax, ymax):
+        """Get positions of points in all cells that intersect bounds.
+
+        Returns
+        -------
+        ndarray of row positions, in no particular order
+        """
+        if (
+            xmax < xmin
+            or ymax < ymin
+            or xmax < self.origin[0]
+            or ymax < self.origin[1]
+            or xmin > self.origin[0] + self.nx * self.cell_size
+            or ymin > self.origin[1] + self.ny * self.cell_size
+        ):
+            return EMPTY
+
+        (ix0, ix1), (iy0, iy1) = self.get_col_row([xmin, xmax], [ymin, ymax])
+
+        # the cells within each row of the grid are contiguous
+        starts = self.offsets[np.arange(iy0, iy1 + 1) * self.nx + ix0]
+        ends = self.offsets[np.arange(iy0, iy1 + 1) * self.nx + ix1 + 1]
+
+        if len(starts) == 1:
+            return self.positions[starts[0] : ends[0]]
+
+        return np.concatenate(
+            [self.positions[start:end] for start, end in zip(starts, ends)]
+        )
+
+    def get_cell(self, ix, iy):
+        start, end = self.offsets[iy * self.nx + ix : iy * self.nx + ix + 2]
+        return self.positions[start:end]
+
+    def get_ring(self, ix, iy, distance):
+        """Get positions of points in cells that are exactly distance cells
+        from (ix, iy) in either direction.
+
+        Returns
+        -------
+        ndarray of row positions, in no particular order
+        """
+        if distance == 0:
+            return self.get_cell(ix, iy)
+
+        x0 = max(ix - distance, 0)
+        x1 = min(ix + distance, self.nx - 1)
+
+        parts = []
+        # full rows above and below
+        for row in (iy - distance, iy + distance):
+            if 0 <= row < self.ny:
+                start = self.offsets[row * self.nx + x0]
+                end = self.offsets[row * self.nx + x1 + 1]
+                parts.append(self.positions[start:end])
+
+        # cells on either side of rows in between
+        for row in range(max(iy - distance + 1, 0), min(iy + distance, self.ny)):
+            for col in (ix - distance, ix + distance):
+                if 0 <= col < self.nx:
+                    parts.append(self.get_cell(col, row))
+
+        if not parts:
+            return EMPTY
+
+        return np.concatenate(parts)
+
+    def get_unsearched_distance(self, x, y, ix, iy, distance):
+        """Calculate the minimum distance in miles from (x, y) to any point outside
+        the cells within distance cells of (ix, iy).
+
+        Returns
+        -------
+        float
+            infinite if all cells have been searched
+        """
+        cell_size = self.cell_size
+        x0, y0 = self.origin
+
+        # distances in degrees to the edge of the searched block on each side
+        # that has unsearched cells beyond it
+        dx = [
+            x - (x0 + (ix - distance) * cell_size) if ix - distance > 0 else np.inf,
+            (x0 + (ix + distance + 1) * cell_size) - x
+            if ix + distance < self.nx - 1
+            else np.inf,
+        ]
+        dy = [
+            y - (y0 + (iy - distance) * cell_size) if iy - distance > 0 else np.inf,
+            (y0 + (iy + distance + 1) * cell_size) - y
+            if iy + distance < self.ny - 1
+            else np.inf,
+        ]
+        dx = max(min(dx), 0)
+        dy = max(min(dy), 0)
+
+        result = np.inf
+        if np.isfinite(dy):
+            result = EARTH_RADIUS * np.radians(dy)
+
+        if np.isfinite(dx):
+            # hav(d) >= cos(lat1) * cos(lat2) * hav(dlon), and all points are
+            # within max_abs_y of the equator
+            cos_y = np.cos(np.radians(max(self.max_abs_y, abs(y))))
+            result = min(
+                result,
+                2
+                * EARTH_RADIUS
+                * np.arcsin(cos_y * np.sin(np.radians(min(dx, 180)) / 2)),
+            )
+
+        return result
+
+    def nearest(self, x, y, k, include=None):
+        """Find the k nearest points to (x, y), by great circle distance.
+
+        Cells are searched in rings of increasing distance from the cell
+        containing (x, y), until k points have been found that are closer than
+        any point in cells that have not been searched.
+
+        Parameters
+        ----------
+        x : float
+            longitude
+        y : float
+            latitude
+        k : int
+            number of points to find
+        include : callable, optional (default: None)
+            called with an ndarray of row positions of candidate points; returns
+            an ndarray of bool indicating the candidates that can be selected.
+            Candidates that are not included do not count toward k.
+
+        Returns
+        -------
+        tuple of (ndarray of row positions, ndarray of distances in miles)
+            sorted by increasing distance
+        """
+        ix, iy = (int(value) for value in self.get_col_row(x, y))
+
+        positions = EMPTY
+        distances = np.array([], dtype="float64")
+        distance = 0
+
+        while True:
+            candidates = self.get_ring(ix, iy, distance)
+            if include is not None and len(candidates):
+                candidates = candidates[include(candidates)]
+
+            if len(candidates):
+                candidate_distances = haversine(
+                    x, y, self.x[candidates], self.y[candidates]
+                )
+                found = np.isfinite(candidate_distances)
+                positions = np.concatenate([positions, candidates[found]])
+                distances = np.concatenate([distances, candidate_distances[found]])
+
+                # only keep candidates that could be among the k nearest
+                if len(distances) > k:
+                    max_distance = np.partition(distances, k - 1)[k - 1]
+                    keep = distances <= max_distance
+                    positions = positions[keep]
+                    distances = distances[keep]
+
+            bound = self.get_unsearched_distance(x, y, ix, iy, distance)
+            if not np.isfinite(bound):
+                break
+
+            if len(distances) >= k and distances.max() <= bound:
+                break
+
+            distance += 1
+
+        # sort by distance, then by position so that results are stable
+        order = np.lexsort((positions, distances))[:k]
+        return positions[order].astype("int64"), distances[order]
+
+    def select_bbox(self, xmin, ymin, xmax, ymax):
+        """Select row positions of points within bounds (inclusive).
+
+        Parameters
+        ----------
+        xmin, ymin, xmax, ymax : float
+
+        Returns
+        -------
+        ndarray of row positions, sorted in increasing order
+        """
+        positions = self.get_cell_range(xmin, ymin, xmax, ymax)
+        x = self.x[positions]
+        y = self.y[positions]
+        positions = positions[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+
+        return np.sort(positions).astype("int64")
+
+    def select_polygons(self, polygons):
+        """Select row positions of points within any of the polygons.
+
+        Points on the boundary of a polygon may or may not be selected.
+
+        Parameters
+        ----------
+        polygons : list of polygons
+            each polygon is a list of rings (exterior and holes), and each ring
+            is an ndarray of (x, y) coordinates; see parse_geometry()
+
+        Returns
+        -------
+        ndarray of row positions, sorted in increasing order
+        """
+        selected = []
+        for rings in polygons:
+            xmin, ymin = rings[0].min(axis=0)
+            xmax, ymax = rings[0].max(axis=0)
+
+            positions = self.get_cell_range(xmin, ymin, xmax, ymax)
+            inside = contains_points(rings, self.x[positions], self.y[positions])
+            selected.append(positions[inside])
+
+        if not selected:
+            return EMPTY
+
+        return np.unique(np.concatenate(selected)).astype("int64")
+
+
+def haversine(x1, y1, x2, y2):
+    """Calculate great circle distance in miles between points.
+
+    Parameters
+    ----------
+    x1, y1 : float or ndarray
+        longitude and latitude of first points
+    x2, y2 : float or ndarray
+        longitude and latitude of second points
+
+    Returns
+    -------
+    float or ndarray
+    """
+    x1, y1, x2, y2 = (
+        np.radians(np.asarray(value, dtype="float64")) for value in (x1, y1, x2, y2)
+    )
+    a = (
+        np.sin((y2 - y1) / 2) ** 2
+        + np.cos(y1) * np.cos(y2) * np.sin((x2 - x1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def contains_points(rings, x, y):
+    """Test if points are within a polygon using the even-odd rule, so that
+    points within holes are excluded.
+
+    Parameters
+    ----------
+    rings : list of ndarray
+        exterior and interior rings of polygon, as arrays of (x, y) coordinates
+    x : ndarray
+    y : ndarray
+
+    Returns
+    -------
+    ndarray of bool
+    """
+    x = x.astype("float64")
+    y = y.astype("float64")
+    inside = np.zeros(len(x), dtype="bool")
+
+    for ring in rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+
+        for i in range(len(x1)):
+            crosses = (y1[i] > y) != (y2[i] > y)
+            if not crosses.any():
+                continue
+
+            # x coordinate where edge crosses the horizontal line through each point
+            cross_x = x1[i] + (y - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i] or 1)
+            inside ^= crosses & (x < cross_x)
+
+    return inside
+
+
+def parse_bbox(text):
+    """Parse bounding box from text.
+
+    Parameters
+    ----------
+    text : str
+        comma-delimited xmin,ymin,xmax,ymax in degrees
+
+    Raises
+    ------
+    ValueError
+        raised if text is not a valid bounding box
+
+    Returns
+    -------
+    tuple of (xmin, ymin, xmax, ymax)
+    """
+    try:
+        bbox = tuple(float(value) for value in text.split(","))
+    except ValueError:
+        raise ValueError("bbox must be comma-delimited numbers")
+
+    if len(bbox) != 4 or not np.isfinite(bbox).all():
+        raise ValueError("bbox must be xmin,ymin,xmax,ymax")
+
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError("bbox minimum must be less than maximum")
+
+    return bbox
+
+
+def parse_geometry(geojson):
+    """Parse polygons from a GeoJSON Polygon or MultiPolygon geometry or Feature.
+
+    Parameters
+    ----------
+    geojson : dict
+
+    Raises
+    ------
+    ValueError
+        raised if geojson is not a valid polygon or multipolygon
+
+    Returns
+    -------
+    list of polygons
+        each polygon is a list of rings (exterior and holes), and each ring is
+        an ndarray of (x, y) coordinates
+    """
+    if not isinstance(geojson, dict):
+        raise ValueError("geometry must be a GeoJSON object")
+
+    if geojson.get("type") == "Feature":
+        geojson = geojson.get("geometry") or {}
+
+    geom_type = geojson.get("type")
+    if geom_type == "Polygon":
+        polygons = [geojson.get("coordinates")]
+    elif geom_type == "MultiPolygon":
+        polygons = geojson.get("coordinates")
+    else:
+        raise ValueError("geometry must be a GeoJSON Polygon or MultiPolygon")
+
+    results = []
+    num_vertices = 0
+    try:
+        for polygon in polygons:
+            rings = [np.asarray(ring, dtype="float64")[:, :2] for ring in polygon]
+            for ring in rings:
+                if len(ring) < 4 or not np.isfinite(ring).all():
+                    raise ValueError
+
+                num_vertices += len(ring)
+
+            if rings:
+                results.append(rings)
+
+    except (TypeError, ValueError, IndexError):
+        raise ValueError("geometry coordinates are not valid polygon rings")
+
+    if not results:
+        raise ValueError("geometry must not be empty")
+
+    if num_vertices > MAX_VERTICES:
+        raise ValueError(
+            "geometry must have no more than {:,} vertices".format(MAX_VERTICES)
+        )
+
+    return results
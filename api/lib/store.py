@@ -0,0 +1,155 @@
+import os
+
+import pyarrow as pa
+from feather import read_dataframe
+
+
+def get_file_version(path):
+    """Identify the version of a file based on its modification time and size.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+
+    Returns
+    -------
+    str
+    """
+    stat = os.stat(path)
+    return "{0}:{1}:{2}".format(path.name, stat.st_mtime_ns, stat.st_size)
+
+
+def write_table(df, path, metadata=None):
+    """Write data frame to an uncompressed Arrow IPC file that can be memory-mapped
+    by each API worker.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    path : pathlib.Path
+        path of output file, by convention with an .arrow suffix
+    metadata : dict, optional (default: None)
+        mapping of str to str added to the schema metadata of the file; see
+        read_table_metadata()
+    """
+    # write as a single record batch so that columns are contiguous in the file
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata(
+            {
+                **(table.schema.metadata or {}),
+                **{k.encode("utf-8"): v.encode("utf-8") for k, v in metadata.items()},
+            }
+        )
+
+    # write to a temporary file and replace atomically, so that the API never
+    # reads a partially written file and existing memory maps remain valid
+    tmp_path = "{}.tmp".format(path)
+    with pa.OSFile(tmp_path, "wb") as sink:
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+
+    os.replace(tmp_path, path)
+
+
+def read_table(path):
+    """Memory-map Arrow IPC file created by write_table() into a data frame.
+
+    Numeric and boolean columns without nulls are read-only views of the file
+    that are shared between all processes that map it, rather than copies.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+
+    # split_blocks prevents consolidating columns into new (copied) arrays
+    return table.to_pandas(split_blocks=True)
+
+
+def read_table_metadata(path):
+    """Read metadata added to an Arrow IPC file by write_table(), without reading
+    its data.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+
+    Returns
+    -------
+    dict
+        mapping of str to str
+    """
+    with pa.memory_map(str(path), "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in metadata.items()}
+
+
+def write_store(df, path):
+    """Write data for use by the API to an uncompressed Arrow IPC file,
+    sorted by HUC12, that can be memory-mapped by each API worker.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        must include "id" and "HUC12" columns
+    path : pathlib.Path
+        path of output file, by convention with an .arrow suffix
+    """
+    write_table(df.sort_values(by="HUC12", kind="mergesort"), path)
+
+
+def get_store_path(data_dir, name):
+    """Get path of data file read by read_store().
+
+    Parameters
+    ----------
+    data_dir : pathlib.Path
+    name : str
+        base name of data file, e.g., "dams"
+
+    Returns
+    -------
+    pathlib.Path
+    """
+    path = data_dir / "{}.arrow".format(name)
+    if os.path.exists(path):
+        return path
+
+    return data_dir / "{}.feather".format(name)
+
+
+def read_store(data_dir, name):
+    """Read data for use by the API, indexed on "id" and sorted by HUC12.
+
+    If an Arrow file created by write_store() is available, it is memory-mapped
+    using read_table().
+
+    Otherwise, the feather file is read into memory and sorted.
+
+    Parameters
+    ----------
+    data_dir : pathlib.Path
+    name : str
+        base name of data file, e.g., "dams"
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    path = get_store_path(data_dir, name)
+
+    if path.suffix == ".arrow":
+        return read_table(path).set_index(["id"])
+
+    return (
+        read_dataframe(path).sort_values(by="HUC12", kind="mergesort").set_index(["id"])
+    )
@@ -0,0 +1,63 @@
+import numpy as np
+
+from api.constants import CUSTOM_TIER_FIELDS
+
+
+class UnitTiers(object):
+    """Custom tiers precomputed for records with networks within each summary
+    unit; see `analysis/rank/precompute_unit_tiers.py`.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        data indexed on id
+    tiers : pandas.DataFrame
+        precomputed tiers, sorted by layer and unit
+
+    Raises
+    ------
+    ValueError
+        raised if tiers include ids that are not present in df
+    """
+
+    def __init__(self, df, tiers):
+        positions = df.index.get_indexer(tiers.id.values)
+        if (positions == -1).any():
+            raise ValueError("precomputed tiers do not match data")
+
+        self.tiers = tiers[CUSTOM_TIER_FIELDS].set_index(tiers.id.rename("id"))
+
+        # rows for each unit are contiguous; find where layer or unit changes
+        layers = np.asarray(tiers.layer.astype(str))
+        units = np.asarray(tiers.unit.astype(str))
+        breaks = (
+            np.flatnonzero((layers[1:] != layers[:-1]) | (units[1:] != units[:-1])) + 1
+        )
+        starts = np.concatenate([[0], breaks]) if len(tiers) else breaks
+        ends = np.concatenate([breaks, [len(tiers)]]) if len(tiers) else breaks
+
+        self.ranges = {
+            (layers[start], units[start]): (start, end)
+            for start, end in zip(starts, ends)
+        }
+
+    def get(self, layer, unit):
+        """Get precomputed tiers of records within a summary unit.
+
+        Parameters
+        ----------
+        layer : str
+            name of field for layer
+        unit : str
+            unit id
+
+        Returns
+        -------
+        pandas.DataFrame or None
+            custom tier fields indexed by id, or None if unit is not present
+        """
+        unit_range = self.ranges.get((layer, unit))
+        if unit_range is None:
+            return None
+
+        return self.tiers.iloc[unit_range[0] : unit_range[1]]
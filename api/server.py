@@ -1,29 +1,73 @@
+from contextlib import nullcontext
+import gc
+import hashlib
 import os
 import json
+import re
 from pathlib import Path
-from io import BytesIO
-from zipfile import ZipFile
+from threading import Lock
 import time
 import logging
 from datetime import date
+import numpy as np
 import pandas as pd
-from feather import read_dataframe
-from flask import Flask, abort, request, send_file, make_response, render_template
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    request,
+    send_file,
+    make_response,
+    render_template,
+    url_for,
+)
 from flask_cors import CORS
 from raven.contrib.flask import Sentry
 from raven.handlers.logging import SentryHandler
 from raven.conf import setup_logging
 
-from analysis.rank.lib.tiers import calculate_tiers, SCENARIOS
+from analysis.rank.lib.tiers import (
+    calculate_group_tiers,
+    calculate_tiers,
+    METRICS,
+    SCENARIOS,
+    CUSTOM_SCENARIO,
+    CUSTOM_METRICS,
+)
+from api.lib.cache import ResultCache, SharedStreams, SingleFlight
+from api.lib.compression import compress, get_encoding
+from api.lib.data import (
+    DataWatcher,
+    Snapshot,
+    get_data_version,
+    load_barrier_data,
+)
+from api.lib.download import iter_csv, stream_zip
+from api.lib.filters import get_bits
+from api.lib.jobs import ExportJobs, COMPLETE, FAILED
+from api.lib.spatial import parse_bbox, parse_geometry
+from api.lib.metrics import Gauge, Histogram, Registry, RequestTimer
+from api.lib.formats import (
+    serialize,
+    CSV_MIMETYPE,
+    ARROW_MIMETYPE,
+    RESPONSE_FORMATS,
+)
 
 from api.constants import (
+    LAYERS,
+    LAYER_FIELDS,
+    DAM_API_FIELDS,
+    SB_API_FIELDS,
     DAM_FILTER_FIELDS,
     DAM_EXPORT_FIELDS,
     SB_FILTER_FIELDS,
     SB_EXPORT_FIELDS,
     TIER_FIELDS,
     CUSTOM_TIER_FIELDS,
-    # domains to invert before download
+    CUSTOM_WEIGHT_TIER_FIELDS,
+    # domains to decode for download
     FEASIBILITY_DOMAIN,
     PURPOSE_DOMAIN,
     CONSTRUCTION_DOMAIN,
@@ -59,22 +103,314 @@ with open(Path(__file__).resolve().parent.parent / "ui/package.json") as infile:
 LOGO_PATH = Path(__file__).resolve().parent.parent / "ui/src/images/sarp_logo.png"
 
 TYPES = ("dams", "barriers")
-LAYERS = ("HUC6", "HUC8", "HUC12", "State", "County", "ECO3", "ECO4")
+
+# Barrier type used to query all TYPES at once
+ALL_TYPES = "all"
+
+# Layer used to select records within an area (bbox or GeoJSON polygon) instead
+# of summary units
+AREA_LAYER = "Area"
+
+# Maximum number of nearest records that can be requested
+MAX_NEAREST = 1000
+
+# fields returned for nearest records
+NEAREST_FIELDS = ["lat", "lon", "Name", "SARPID", "HasNetwork"] + TIER_FIELDS
 FORMATS = ("csv",)  # TODO: "shp"
 
+# domains of coded fields that are decoded for download
+DOMAIN_FIELDS = {
+    "HasNetwork": BOOLEAN_DOMAIN,
+    "Excluded": BOOLEAN_DOMAIN,
+    "OwnerType": OWNERTYPE_DOMAIN,
+    "ProtectedLand": BOOLEAN_DOMAIN,
+    "HUC8_USFS": HUC8_USFS_DOMAIN,
+    "HUC8_COA": HUC8_COA_DOMAIN,
+    "HUC8_SGCN": HUC8_SGCN_DOMAIN,
+}
+
+DAM_DOMAIN_FIELDS = {
+    **DOMAIN_FIELDS,
+    "Condition": DAM_CONDITION_DOMAIN,
+    "Construction": CONSTRUCTION_DOMAIN,
+    "Purpose": PURPOSE_DOMAIN,
+    "Feasibility": FEASIBILITY_DOMAIN,
+}
+
+SB_DOMAIN_FIELDS = {**DOMAIN_FIELDS, "SeverityClass": BARRIER_SEVERITY_DOMAIN}
+
+# fields that may be requested from query: filter fields (returned by default) and
+# export fields that are available before ranking
+DAM_QUERY_FIELDS = DAM_FILTER_FIELDS + [
+    f for f in DAM_EXPORT_FIELDS if f in DAM_API_FIELDS and not f in DAM_FILTER_FIELDS
+]
+SB_QUERY_FIELDS = SB_FILTER_FIELDS + [
+    f for f in SB_EXPORT_FIELDS if f in SB_API_FIELDS and not f in SB_FILTER_FIELDS
+]
+
+# fields that may be requested from query and fields returned by default, for
+# each barrier type
+QUERY_FIELDS = {
+    "dams": (DAM_QUERY_FIELDS, DAM_FILTER_FIELDS),
+    "barriers": (SB_QUERY_FIELDS, SB_FILTER_FIELDS),
+}
+
+# request headers that responses vary by
+VARY = "Accept, Accept-Encoding"
+
 # create maps of fields to lower case equivalents
 dam_filter_field_map = {f.lower(): f for f in DAM_FILTER_FIELDS}
 barrier_filter_field_map = {f.lower(): f for f in SB_FILTER_FIELDS}
+custom_metric_map = {f.lower(): f for f in CUSTOM_METRICS}
+tier_field_map = {f.lower(): f for f in TIER_FIELDS}
+
+
+# Cache of custom ranking results, bounded by size in MB
+CACHE_SIZE = int(os.getenv("API_CACHE_SIZE", 100))
+cache = ResultCache(CACHE_SIZE * 1000000)
+
+# Calculations in progress, shared by identical concurrent requests
+in_flight = SingleFlight()
+
+# Downloads in progress, streamed from a spool file by identical concurrent requests
+downloads = SharedStreams()
+
+
+DATA_DIR = Path(os.getenv("API_DATA_DIR", "data/api"))
+DATA_NAMES = ("dams", "small_barriers")
+
+# Downloads built in the background are stored here, and reused until the data
+# version changes
+EXPORT_DIR = Path(os.getenv("API_EXPORT_DIR", "data/exports"))
+# Number of background downloads built at the same time by each worker process
+EXPORT_WORKERS = int(os.getenv("API_EXPORT_WORKERS", 2))
+exports = ExportJobs(EXPORT_DIR, EXPORT_WORKERS)
+
+# Background downloads are identified by the hash of the normalized request
+JOB_ID = re.compile(r"^[0-9a-f]{40}$")
+
+# Request metrics, reported by each worker process at /api/v1/metrics
+metrics = Registry()
+request_duration = metrics.add(
+    Histogram(
+        "api_request_duration_seconds",
+        "Duration of requests, excluding streaming of response body",
+        ["endpoint", "status"],
+    )
+)
+phase_duration = metrics.add(
+    Histogram(
+        "api_request_phase_duration_seconds",
+        "Duration of each phase of requests",
+        ["endpoint", "phase"],
+    )
+)
+requests_in_flight = metrics.add(
+    Gauge("api_requests_in_flight", "Number of requests in progress", ["endpoint"])
+)
+data_info = metrics.add(Gauge("api_data_info", "Data version in use", ["version"]))
+data_loaded = metrics.add(
+    Gauge(
+        "api_data_loaded_timestamp_seconds",
+        "Time when the data version in use was loaded",
+    )
+)
+cache_stats = metrics.add(
+    Gauge("api_cache", "Statistics of the result cache", ["stat"])
+)
+in_flight_stats = metrics.add(
+    Gauge(
+        "api_in_flight_calculations",
+        "Statistics of calculations shared by identical concurrent requests",
+        ["stat"],
+    )
+)
+download_stats = metrics.add(
+    Gauge(
+        "api_shared_downloads",
+        "Statistics of downloads shared by identical concurrent requests",
+        ["stat"],
+    )
+)
+
+
+# Number of seconds that clients and proxies may reuse responses before revalidating
+# them using their ETag
+MAX_AGE = int(os.getenv("API_MAX_AGE", 300))
+
+
+# Number of seconds between checks for new data files; 0 disables reloading
+RELOAD_INTERVAL = int(os.getenv("API_RELOAD_INTERVAL", 60))
+
+# Snapshot of all data used by the API; swapped atomically on reload.
+# Requests must get this once and use it throughout.
+snapshot = None
+
+
+def load_snapshot(version=None):
+    """Read source data into memory, validate against the API fields, and build indexes.
+
+    Data are sorted by HUC12 so that HUCs can be selected as contiguous ranges of rows.
+    Records with networks are selected by row position rather than from copies
+    of the data.
+
+    Parameters
+    ----------
+    version : str, optional (default: None)
+        data version; if None, it is calculated from the data files
+
+    Returns
+    -------
+    Snapshot
+    """
+    if version is None:
+        version = get_data_version(DATA_DIR, DATA_NAMES)
+
+    dams = load_barrier_data(
+        DATA_DIR,
+        "dams",
+        DAM_API_FIELDS,
+        LAYER_FIELDS,
+        DAM_FILTER_FIELDS,
+        DAM_DOMAIN_FIELDS,
+    )
+    barriers = load_barrier_data(
+        DATA_DIR,
+        "small_barriers",
+        SB_API_FIELDS,
+        LAYER_FIELDS,
+        SB_FILTER_FIELDS,
+        SB_DOMAIN_FIELDS,
+    )
+
+    return Snapshot(version, dams, barriers)
+
+
+def set_snapshot(new_snapshot):
+    """Use new snapshot for all subsequent requests; in-flight requests complete
+    using the previous snapshot.
+
+    Cached results and background downloads of previous versions are invalidated.
+
+    Parameters
+    ----------
+    new_snapshot : Snapshot
+    """
+    global snapshot
+
+    snapshot = new_snapshot
+    cache.clear()
+    exports.remove_stale(new_snapshot.version)
+
+    data_info.clear()
+    data_info.set(1, version=new_snapshot.version)
+    data_loaded.set(time.time())
+
+
+def reload_data(version):
+    """Load new data version in the background and swap it in once complete.
+    If the new data cannot be loaded, the current data remain in use.
+
+    Parameters
+    ----------
+    version : str
+
+    Returns
+    -------
+    bool
+        True if data were loaded successfully
+    """
+    try:
+        set_snapshot(load_snapshot(version))
+        log.info("loaded data version {}".format(version))
+        return True
+
+    except:
+        log.error("not able to load data version {}".format(version))
+        sentry.captureException()
+        return False
+
+
+watcher_lock = Lock()
+watcher_pid = None
+
+
+@app.before_request
+def start_watcher():
+    """Start a thread in each worker process to watch for new data files.
+
+    Each worker loads new data on its own, so data reloaded by workers forked
+    from a preloaded app (gunicorn --preload) are no longer shared between them.
+    """
+    global watcher_pid
+
+    if not RELOAD_INTERVAL or watcher_pid == os.getpid():
+        return
+
+    with watcher_lock:
+        if watcher_pid == os.getpid():
+            return
+
+        watcher_pid = os.getpid()
+        DataWatcher(
+            lambda: get_data_version(DATA_DIR, DATA_NAMES),
+            lambda: snapshot.version if snapshot is not None else None,
+            reload_data,
+            RELOAD_INTERVAL,
+        ).start()
+
+
+@app.before_request
+def start_timer():
+    endpoint = request.endpoint or "other"
+    g.timer = RequestTimer(phase_duration, endpoint)
+    requests_in_flight.inc(endpoint=endpoint)
+
+
+@app.after_request
+def add_timing(response):
+    """Add durations of request phases to the response in a Server-Timing header,
+    and record duration of the request."""
+    timer = g.get("timer")
+    if timer is not None:
+        response.headers["Server-Timing"] = timer.get_header()
+        response.headers["Timing-Allow-Origin"] = "*"
+        request_duration.observe(
+            timer.elapsed(), endpoint=timer.endpoint, status=response.status_code
+        )
+
+    return response
+
+
+@app.teardown_request
+def end_timer(exc=None):
+    timer = g.get("timer")
+    if timer is not None:
+        requests_in_flight.dec(endpoint=timer.endpoint)
+
+
+def timed(phase):
+    """Time the enclosed block as a phase of the current request.  Blocks run
+    outside a request, e.g., for background downloads, are not timed.
+
+    Parameters
+    ----------
+    phase : str
+    """
+    timer = g.get("timer")
+    if timer is None:
+        return nullcontext()
+
+    return timer.phase(phase)
 
 
-# Read source data into memory
 try:
-    data_dir = Path("data/api")
-    dams = read_dataframe(data_dir / "dams.feather").set_index(["id"])
-    dams_with_networks = dams.loc[dams.HasNetwork]
+    set_snapshot(load_snapshot())
 
-    barriers = read_dataframe(data_dir / "small_barriers.feather").set_index(["id"])
-    barriers_with_networks = barriers.loc[barriers.HasNetwork]
+    # Move objects created while loading data into the permanent generation, so that
+    # garbage collection in forked workers (gunicorn --preload) does not write to,
+    # and thereby copy, their memory pages
+    gc.freeze()
 
     print("Data loaded")
 
@@ -94,11 +430,11 @@ def validate_type(barrier_type):
 
 
 def validate_layer(layer):
-    if not layer in LAYERS:
+    if not (layer in LAYERS or layer == AREA_LAYER):
         abort(
             400,
             "layer is not valid: {0}; must be one of {1}".format(
-                layer, ", ".join(LAYERS)
+                layer, ", ".join(LAYERS + (AREA_LAYER,))
             ),
         )
 
@@ -108,26 +444,694 @@ def validate_format(format):
         abort(400, "format is not valid; must be one of {0}".format(", ".join(FORMATS)))
 
 
-def validate_sort(sort):
-    if not sort in SCENARIOS.keys():
+def get_response_format():
+    """Determine the response format of query and rank endpoints from the
+    format query parameter, if present, or the Accept header of the request.
+
+    Returns
+    -------
+    str
+        one of RESPONSE_FORMATS
+    """
+    format = request.args.get("format", None)
+
+    if format is None:
+        mimetype = request.accept_mimetypes.best_match(
+            [CSV_MIMETYPE, ARROW_MIMETYPE], CSV_MIMETYPE
+        )
+        return "arrow" if mimetype == ARROW_MIMETYPE else "csv"
+
+    if not format in RESPONSE_FORMATS:
         abort(
             400,
-            "sort is not valid; must be one of {0}".format(
-                ", ".join(list(SCENARIOS.keys()))
+            "format is not valid; must be one of {0}".format(
+                ", ".join(RESPONSE_FORMATS)
             ),
         )
 
+    return format
+
+
+def make_encoded_response(body, key=None):
+    """Create response for body, compressed according to the Accept-Encoding
+    header of the request.
+
+    Compressed versions of body are stored in the result cache, so that body
+    is only compressed once for each encoding.  Responses are not compressed
+    if the result cache is disabled; these are compressed by nginx instead.
+
+    Parameters
+    ----------
+    body : bytes
+    key : tuple, optional (default: None)
+        normalized request key of body; see get_request_key().  If None, the
+        response is not compressed.
+
+    Returns
+    -------
+    flask.Response
+    """
+    encoding = None
+    if key is not None and cache.max_bytes:
+        encoding = get_encoding(request.accept_encodings, len(body))
+
+    if encoding is not None:
+        encoded_key = (key, encoding)
+        encoded = cache.get(encoded_key)
+        if encoded is None:
+            with timed("compress"):
+                encoded = compress(body, encoding)
+            cache.set(encoded_key, encoded)
+
+        body = encoded
+
+    resp = make_response(body)
+    if encoding is not None:
+        resp.headers["Content-Encoding"] = encoding
+
+    resp.headers["Vary"] = VARY
+    return resp
+
+
+def make_table_response(body, format, etag=None, key=None):
+    """Create response for serialized table.
+
+    Parameters
+    ----------
+    body : bytes
+    format : str
+        one of RESPONSE_FORMATS
+    etag : str, optional (default: None)
+        if present, ETag and Cache-Control headers are added; see get_etag()
+    key : tuple, optional (default: None)
+        if present, the response is compressed; see make_encoded_response()
+
+    Returns
+    -------
+    flask.Response
+    """
+    resp = make_encoded_response(body, key)
+    resp.headers["Content-Type"] = RESPONSE_FORMATS[format]
+
+    if etag is not None:
+        add_cache_headers(resp, etag)
+
+    return resp
+
+
+def get_etag(key):
+    """Create a strong ETag for a request from its normalized key, which
+    includes the data version.
+
+    Parameters
+    ----------
+    key : tuple
+        normalized request key; see get_request_key()
+
+    Returns
+    -------
+    str
+    """
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def add_cache_headers(resp, etag):
+    """Add ETag and Cache-Control headers so that clients and proxies can reuse
+    the response.
+
+    The ETag of a compressed response is weak, since its bytes differ from the
+    uncompressed response.
+
+    Parameters
+    ----------
+    resp : flask.Response
+    etag : str
+
+    Returns
+    -------
+    flask.Response
+    """
+    resp.set_etag(etag, weak="Content-Encoding" in resp.headers)
+    resp.headers["Cache-Control"] = "public, max-age={}".format(MAX_AGE)
+    return resp
+
+
+def get_not_modified(etag):
+    """Create a 304 (Not Modified) response if the ETag of the client's copy of
+    the response matches the current ETag (If-None-Match).
+
+    ETags are compared using weak comparison, as required for If-None-Match;
+    nginx converts strong ETags to weak ETags when it compresses responses.
+
+    Parameters
+    ----------
+    etag : str
+
+    Returns
+    -------
+    flask.Response or None
+        None if the response must be created
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    resp = Response(status=304)
+    resp.headers["Vary"] = VARY
+    return add_cache_headers(resp, etag)
+
+
+def get_weights():
+    """Extract user-defined weights for the custom scenario from the weights
+    query parameter of the request, which is a comma-delimited list of
+    <metric>:<weight> using lowercased metric names.
+
+    Returns
+    -------
+    dict or None
+        mapping of metric field name to weight, normalized to sum to 1.
+        None if weights are not provided.
+    """
+    arg = request.args.get("weights", "")
+    if not arg:
+        return None
+
+    weights = {}
+    for entry in arg.split(","):
+        metric, _, weight = entry.partition(":")
+        metric = metric.lower()
+
+        if not metric in custom_metric_map:
+            abort(
+                400,
+                "weights metric is not valid: {0}; must be one of {1}".format(
+                    metric, ", ".join(custom_metric_map)
+                ),
+            )
+
+        try:
+            weight = float(weight)
+        except ValueError:
+            abort(400, "weight for {0} must be a number".format(metric))
+
+        if not 0 <= weight < float("inf"):
+            abort(400, "weight for {0} must be a positive number".format(metric))
+
+        weights[custom_metric_map[metric]] = weight
+
+    total = sum(weights.values())
+    if not total > 0:
+        abort(400, "at least one weight must be greater than 0")
+
+    return {metric: weight / total for metric, weight in weights.items() if weight}
+
+
+def get_ids(layer):
+    """Extract ids of summary units from the query parameters of the request.
+
+    For AREA_LAYER, the area is instead defined by a bbox (xmin,ymin,xmax,ymax)
+    or geometry (GeoJSON Polygon or MultiPolygon) query parameter, or by GeoJSON
+    in the body of a POST request.  It is normalized to a single id, so that it
+    can be used in place of the ids of summary units; see select_area().
+
+    Parameters
+    ----------
+    layer : str
+
+    Returns
+    -------
+    list of str
+    """
+    args = request.args
+
+    if layer != AREA_LAYER:
+        ids = [id for id in args.get("id", "").split(",") if id]
+        if not ids:
+            abort(400, "id must be non-empty")
+
+        return ids
+
+    try:
+        if "bbox" in args:
+            bbox = parse_bbox(args["bbox"])
+            return ["bbox:{}".format(",".join(repr(value) for value in bbox))]
+
+        if request.method == "POST":
+            geojson = request.get_json(silent=True)
+        else:
+            try:
+                geojson = json.loads(args.get("geometry", "null"))
+            except ValueError:
+                abort(400, "geometry must be valid GeoJSON")
+
+        if geojson is None:
+            abort(400, "bbox or geometry must be provided for layer {}".format(layer))
+
+        polygons = parse_geometry(geojson)
+
+    except ValueError as ex:
+        abort(400, str(ex))
+
+    coords = [[ring.tolist() for ring in rings] for rings in polygons]
+    return ["geometry:{}".format(json.dumps(coords, separators=(",", ":")))]
+
+
+def select_area(data, id):
+    """Select row positions of records within an area.
+
+    Parameters
+    ----------
+    data : BarrierData
+    id : str
+        normalized area created by get_ids()
+
+    Returns
+    -------
+    ndarray of row positions
+    """
+    kind, _, value = id.partition(":")
+
+    if kind == "bbox":
+        return data.spatial.select_bbox(*parse_bbox(value))
+
+    return data.spatial.select_polygons(
+        parse_geometry({"type": "MultiPolygon", "coordinates": json.loads(value)})
+    )
+
+
+def get_filters(field_map, exclude=("id", "format", "weights", "bbox", "geometry")):
+    """Extract filters from the query parameters of the request.
+
+    Parameters
+    ----------
+    field_map : dict
+        mapping of lowercased field name to field name
+    exclude : list-like, optional (default: ("id", "format", "weights", "bbox", "geometry"))
+        query parameters that are NOT filters
+
+    Returns
+    -------
+    dict
+        mapping of field name to list of integer values
+    """
+    filters = {}
+    for key in request.args:
+        if key in exclude:
+            continue
+
+        if not key in field_map:
+            abort(400, "filter is not valid: {0}".format(key))
+
+        # convert all incoming to integers
+        filters[field_map[key]] = [int(x) for x in request.args.get(key).split(",")]
+
+    return filters
+
+
+def get_fields(fields):
+    """Extract fields to return from the fields query parameter of the request,
+    which is a comma-delimited list of lowercased field names.
+
+    Parameters
+    ----------
+    fields : list-like
+        field names that may be requested, in the order they are returned
+
+    Returns
+    -------
+    list or None
+        requested field names in the order of fields, or None if fields are not
+        provided.  id is always returned and is not included.
+    """
+    value = request.args.get("fields", "")
+    if not value:
+        return None
+
+    field_map = {f.lower(): f for f in fields}
+    requested = set()
+    for field in value.split(","):
+        field = field.strip().lower()
+        if field == "id":
+            continue
+
+        if not field in field_map:
+            abort(400, "field is not valid: {0}".format(field))
+
+        requested.add(field_map[field])
+
+    return [f for f in fields if f in requested]
+
+
+def get_request_key(version, kind, barrier_type, layer, ids, filters, weights=None):
+    """Create a normalized key for a request, independent of the order of ids,
+    filters, and filter values.
+
+    Parameters
+    ----------
+    version : str
+        data version
+    kind : str
+        kind of result, e.g., "rank"
+    barrier_type : str
+    layer : str
+    ids : list-like
+    filters : dict
+        mapping of field name to list of values
+    weights : dict, optional (default: None)
+        mapping of metric field name to weight
+
+    Returns
+    -------
+    tuple
+    """
+    return (
+        version,
+        kind,
+        barrier_type,
+        layer,
+        tuple(sorted(set(ids))),
+        tuple(
+            sorted(
+                (field, tuple(sorted(set(values)))) for field, values in filters.items()
+            )
+        ),
+        tuple(sorted((weights or {}).items())),
+    )
+
+
+def get_result(key, func):
+    """Get result of a request from the result cache, or calculate it using func
+    and add it to the cache.
+
+    Identical requests that arrive while the result is being calculated wait
+    for that calculation and share its result.
+
+    Parameters
+    ----------
+    key : tuple
+        normalized request key; see get_request_key()
+    func : callable
+        called without arguments to calculate the result
+
+    Returns
+    -------
+    result of func
+    """
+    result = cache.get(key)
+    if result is None:
+
+        def calculate():
+            result = func()
+            cache.set(key, result)
+            return result
+
+        result = in_flight.do(key, calculate)
+
+    return result
+
+
+def get_custom_tiers(df, key, weights=None):
+    """Calculate custom tiers for records in df, using cached results where available.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        records selected by the request
+    key : tuple
+        normalized request key; see get_request_key()
+    weights : dict, optional (default: None)
+        user-defined weights for the custom scenario; see get_weights()
+
+    Returns
+    -------
+    pandas.DataFrame
+        custom tier fields indexed by id
+    """
+    fields = CUSTOM_TIER_FIELDS + (CUSTOM_WEIGHT_TIER_FIELDS if weights else [])
+    return get_result(key, lambda: calculate_tiers(df, weights=weights)[fields])
+
+
+def get_unit_tiers(data, layer, ids, filters, weights=None):
+    """Get custom tiers precomputed for records with networks in a single summary unit.
+
+    Parameters
+    ----------
+    data : BarrierData
+    layer : str
+        name of field for layer
+    ids : list-like
+        unit ids selected by the request
+    filters : dict
+        filters selected by the request; see get_filters()
+    weights : dict, optional (default: None)
+        user-defined weights for the custom scenario; see get_weights()
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        custom tier fields indexed by id, or None if tiers were not precomputed
+        for this request and must be calculated instead
+    """
+    if data.unit_tiers is None or filters or weights or len(set(ids)) != 1:
+        return None
+
+    return data.unit_tiers.get(layer, ids[0])
+
+
+def select_units(data, layer, ids, networks_only=True):
+    """Select row positions of records within summary units using the index
+    of that barrier type, or within an area using the spatial index.
+
+    Parameters
+    ----------
+    data : BarrierData
+    layer : str
+        name of field for layer, or AREA_LAYER
+    ids : list-like
+        unit ids to select, or normalized area for AREA_LAYER; see get_ids()
+    networks_only : bool (default: True)
+        if True, only records with networks are selected
+
+    Returns
+    -------
+    ndarray of row positions
+    """
+    if layer == AREA_LAYER:
+        positions = select_area(data, ids[0])
+    else:
+        positions = data.index.select(layer, ids)
+
+    if networks_only:
+        positions = positions[data.df.HasNetwork.values[positions]]
+
+    return positions
+
+
+def validate_sort(sort, weights=None):
+    scenarios = list(SCENARIOS.keys())
+    if weights:
+        scenarios.append(CUSTOM_SCENARIO)
+
+    if not sort in scenarios:
+        abort(400, "sort is not valid; must be one of {0}".format(", ".join(scenarios)))
+
+
+def get_dtype_kind(dtype):
+    """Classify dtype as "bool", "numeric", or "text" to check whether fields of
+    different barrier types can be combined.
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+
+    return "text"
+
+
+def concat_types(frames, types):
+    """Combine records of several barrier types into a single data frame, with a
+    kind field containing the type of each record.
+
+    Fields that are not present for all types are null for records of the other
+    types; integer and boolean fields are converted to nullable types so that
+    they are not converted to float.
+
+    Fields present for more than one type must have compatible types (numeric,
+    boolean, or text); otherwise the request is aborted with a 400 response.
+
+    Parameters
+    ----------
+    frames : list of pandas.DataFrame
+        records of each type
+    types : list-like
+        barrier type of each data frame
+
+    Returns
+    -------
+    pandas.DataFrame
+        records of all types, indexed by the id of each record within its type
+    """
+    for col in set(col for frame in frames for col in frame.columns):
+        kinds = set(
+            get_dtype_kind(frame[col].dtype) for frame in frames if col in frame.columns
+        )
+        if len(kinds) > 1:
+            abort(
+                400,
+                "field {0} has different types for {1}; request it for a single "
+                "barrier type".format(col.lower(), ", ".join(types)),
+            )
+
+    df = pd.concat(frames, sort=False)
+    df.insert(0, "kind", np.repeat(types, [len(frame) for frame in frames]))
+
+    for col in df.columns.difference(["kind"]):
+        dtypes = [frame[col].dtype for frame in frames if col in frame.columns]
+        if len(dtypes) == len(frames):
+            continue
 
-@app.route("/api/v1/<barrier_type>/query/<layer>", methods=["GET"])
+        if all(pd.api.types.is_bool_dtype(dtype) for dtype in dtypes):
+            df[col] = df[col].astype("boolean")
+        elif all(pd.api.types.is_integer_dtype(dtype) for dtype in dtypes):
+            df[col] = df[col].astype("Int64")
+
+    return df
+
+
+@app.route("/api/v1/<barrier_type>/query/<layer>", methods=["GET", "POST"])
 def query(barrier_type="dams", layer="HUC8"):
     """Filter dams and return key properties for filtering.  ONLY for those with networks.
 
+    Path parameters:
+    <barrier_type> : one of TYPES, or ALL_TYPES to return records of all types with
+      a kind field containing the type of each record
+    <layer> : one of LAYERS, or AREA_LAYER
+
+    Query parameters:
+    * id: list of ids
+    * bbox or geometry: area to select if layer is AREA_LAYER; see get_ids()
+    * format: str, one of 'csv', 'arrow' (default: based on Accept header, otherwise 'csv')
+    * fields: optional comma-delimited list of lowercased fields to return, from
+      DAM_QUERY_FIELDS or SB_QUERY_FIELDS (default: filter fields).  For ALL_TYPES,
+      fields of any type may be requested, and are null for records of the types
+      that do not have them.
+
+    Parameters
+    ----------
+    layer : str (default: HUC8)
+        Layer to use for subsetting by ID.  One of: HUC6, HUC8, HUC12, State, ... TBD
+    """
+
+    if barrier_type == ALL_TYPES:
+        types = TYPES
+    else:
+        validate_type(barrier_type)
+        types = (barrier_type,)
+
+    validate_layer(layer)
+
+    if layer == "County":
+        layer = "COUNTYFIPS"
+
+    ids = get_ids(layer)
+
+    format = get_response_format()
+
+    # fields of all types, in the order of the first type that has them
+    available = list(dict.fromkeys(f for t in types for f in QUERY_FIELDS[t][0]))
+    default = list(dict.fromkeys(f for t in types for f in QUERY_FIELDS[t][1]))
+    requested = get_fields(available)
+    fields = requested if requested is not None else default
+
+    snap = snapshot
+
+    key = get_request_key(
+        snap.version,
+        "query:{0}:{1}".format(format, ",".join(fields)),
+        barrier_type,
+        layer,
+        ids,
+        {},
+    )
+    etag = get_etag(key)
+    not_modified = get_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    def get_body():
+        if format == "csv" and fields == default and barrier_type != ALL_TYPES:
+            # CSV of the default fields is assembled from rows serialized when
+            # data were loaded
+            data = snap.get(barrier_type)
+            with timed("select"):
+                positions = select_units(data, layer, ids)
+
+            log.info("selected {} {}".format(len(positions), barrier_type))
+
+            with timed("serialize"):
+                return data.csv_rows.get(positions)
+
+        frames = []
+        with timed("select"):
+            for kind in types:
+                data = snap.get(kind)
+                # fields are only taken from the field lists of each type, since
+                # fields with the same name may have different meanings
+                kind_fields = QUERY_FIELDS[kind][0 if requested is not None else 1]
+                columns = [f for f in fields if f in kind_fields]
+                frames.append(data.df.iloc[select_units(data, layer, ids)][columns])
+
+                log.info("selected {} {}".format(len(frames[-1].index), kind))
+
+        if barrier_type == ALL_TYPES:
+            df = concat_types(frames, types)[["kind"] + fields]
+        else:
+            df = frames[0]
+
+        with timed("serialize"):
+            return serialize(df, format)
+
+    body = get_result(key, get_body)
+
+    return make_table_response(body, format, etag, key)
+
+
+@app.route("/api/v1/metrics", methods=["GET"])
+def get_metrics():
+    """Return request metrics of this worker process in Prometheus text format."""
+    for stat, value in cache.stats().items():
+        cache_stats.set(value, stat=stat)
+
+    for stat, value in in_flight.stats().items():
+        in_flight_stats.set(value, stat=stat)
+
+    for stat, value in downloads.stats().items():
+        download_stats.set(value, stat=stat)
+
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+@app.route("/api/v1/<barrier_type>/counts/<layer>", methods=["GET", "POST"])
+def counts(barrier_type="dams", layer="HUC8"):
+    """Count dams for each value of each filter field.  ONLY for those with networks.
+
+    Counts for each filter field are calculated from records that meet the
+    filters of all other fields, but not the filter of that field.
+
     Path parameters:
     <barrier_type> : one of TYPES
-    <layer> : one of LAYERS
+    <layer> : one of LAYERS, or AREA_LAYER
 
     Query parameters:
     * id: list of ids
+    * bbox or geometry: area to select if layer is AREA_LAYER; see get_ids()
+    * filters are defined using a lowercased version of column name and a comma-delimited list of values
+
+    Returns JSON:
+    {
+        "total": <number of records that meet all filters>,
+        "counts": {<lowercased filter field>: {<value>: <count>, ...}, ...}
+    }
 
     Parameters
     ----------
@@ -141,40 +1145,162 @@ def query(barrier_type="dams", layer="HUC8"):
     if layer == "County":
         layer = "COUNTYFIPS"
 
-    ids = [id for id in request.args.get("id", "").split(",") if id]
-    if not ids:
-        abort(400, "id must be non-empty")
+    ids = get_ids(layer)
+
+    snap = snapshot
+    data = snap.get(barrier_type)
 
     if barrier_type == "dams":
-        df = dams_with_networks
-        # field_map = dam_filter_field_map
-        fields = DAM_FILTER_FIELDS
+        field_map = dam_filter_field_map
     else:
-        df = barriers_with_networks
-        # field_map = barrier_filter_field_map
-        fields = SB_FILTER_FIELDS
+        field_map = barrier_filter_field_map
+
+    filters = get_filters(field_map)
+
+    key = get_request_key(snap.version, "counts", barrier_type, layer, ids, filters)
+    etag = get_etag(key)
+    not_modified = get_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    def get_body():
+        with timed("select"):
+            positions = select_units(data, layer, ids)
+
+        with timed("counts"):
+            counts = data.filters.counts(positions, filters)
+
+        return json.dumps(
+            {
+                "total": len(data.filters.select(positions, filters)),
+                "counts": {
+                    field.lower(): field_counts
+                    for field, field_counts in counts.items()
+                },
+            }
+        ).encode("utf-8")
+
+    body = get_result(key, get_body)
+
+    resp = make_encoded_response(body, key)
+    resp.mimetype = "application/json"
+    return add_cache_headers(resp, etag)
+
+
+@app.route("/api/v1/<barrier_type>/nearest", methods=["GET"])
+def nearest(barrier_type="dams"):
+    """Find the dams nearest to a point.
 
-    df = df.loc[df[layer].isin(ids)][fields].copy()
-    log.info("selected {} {}".format(len(df.index), barrier_type))
+    Filters are applied while searching, so that the nearest records that meet
+    all filters are returned.
 
-    resp = make_response(
-        df.to_csv(index_label="id", header=[c.lower() for c in df.columns])
+    Path parameters:
+    <barrier_type> : one of TYPES
+
+    Query parameters:
+    * lat, lon: location in degrees
+    * k: int, number of records to return (default: 10, maximum: MAX_NEAREST)
+    * ranked: bool (default: False); set to true to only include records with networks
+    * format: str, one of 'csv', 'arrow' (default: based on Accept header, otherwise 'csv')
+    * tiers are limited using a lowercased version of tier field and the maximum tier, e.g., se_ncwc_tier=5
+    * filters are defined using a lowercased version of column name and a comma-delimited list of values
+
+    Returns NEAREST_FIELDS and distance in miles, sorted by distance.
+    """
+    args = request.args
+
+    validate_type(barrier_type)
+
+    try:
+        lat = float(args.get("lat", ""))
+        lon = float(args.get("lon", ""))
+        k = int(args.get("k", 10))
+    except ValueError:
+        abort(400, "lat and lon must be numbers and k must be an integer")
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        abort(400, "lat and lon must be valid coordinates in degrees")
+
+    if not 0 < k <= MAX_NEAREST:
+        abort(400, "k must be between 1 and {}".format(MAX_NEAREST))
+
+    ranked = bool(args.get("ranked", False))
+
+    max_tiers = {}
+    for key in args:
+        if key in tier_field_map:
+            try:
+                max_tiers[tier_field_map[key]] = int(args[key])
+            except ValueError:
+                abort(400, "{} must be an integer".format(key))
+
+    snap = snapshot
+    data = snap.get(barrier_type)
+
+    if barrier_type == "dams":
+        field_map = dam_filter_field_map
+    else:
+        field_map = barrier_filter_field_map
+
+    query_params = ("lat", "lon", "k", "ranked", "format") + tuple(tier_field_map)
+    filters = get_filters(field_map, exclude=query_params)
+    format = get_response_format()
+
+    point = "{0!r},{1!r},{2},{3}".format(lat, lon, k, int(ranked))
+    key = get_request_key(
+        snap.version,
+        "nearest:{}".format(format),
+        barrier_type,
+        "point",
+        [point],
+        dict(filters, **{field: [value] for field, value in max_tiers.items()}),
     )
+    etag = get_etag(key)
+    not_modified = get_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
 
-    resp.headers["Content-Type"] = "text/csv"
-    return resp
+    df = data.df
+    mask = data.filters.mask(filters)
+
+    def include(positions):
+        result = np.ones(len(positions), dtype="bool")
+        if mask is not None:
+            result &= get_bits(mask, positions)
+        if ranked:
+            result &= df.HasNetwork.values[positions]
+        for field, max_tier in max_tiers.items():
+            tiers = df[field].values[positions]
+            result &= (tiers >= 1) & (tiers <= max_tier)
+
+        return result
+
+    with timed("nearest"):
+        positions, distances = data.spatial.nearest(lon, lat, k, include=include)
+
+    df = df.iloc[positions][NEAREST_FIELDS].copy()
+    df["distance"] = distances.round(3)
 
+    with timed("serialize"):
+        body = serialize(df, format)
 
-@app.route("/api/v1/<barrier_type>/rank/<layer>", methods=["GET"])
+    return make_table_response(body, format, etag)
+
+
+@app.route("/api/v1/<barrier_type>/rank/<layer>", methods=["GET", "POST"])
 def rank(barrier_type="dams", layer="HUC8"):
     """Rank a subset of dams data.
 
     Path parameters:
     <barrier_type> : one of TYPES
-    <layer> : one of LAYERS
+    <layer> : one of LAYERS, or AREA_LAYER
 
     Query parameters:
     * id: list of ids
+    * bbox or geometry: area to select if layer is AREA_LAYER; see get_ids()
+    * format: str, one of 'csv', 'arrow' (default: based on Accept header, otherwise 'csv')
+    * weights: optional comma-delimited list of <metric>:<weight> for the custom scenario,
+      using lowercased names of CUSTOM_METRICS
     * filters are defined using a lowercased version of column name and a comma-delimited list of values
 
     Parameters
@@ -191,49 +1317,201 @@ def rank(barrier_type="dams", layer="HUC8"):
     if layer == "County":
         layer = "COUNTYFIPS"
 
-    ids = [id for id in args.get("id", "").split(",") if id]
-    if not ids:
-        abort(400, "id must be non-empty")
+    ids = get_ids(layer)
+
+    snap = snapshot
+    data = snap.get(barrier_type)
 
     if barrier_type == "dams":
-        df = dams_with_networks
         field_map = dam_filter_field_map
     else:
-        df = barriers_with_networks
         field_map = barrier_filter_field_map
 
-    filters = df[layer].isin(ids)
+    filters = get_filters(field_map)
+    weights = get_weights()
+    format = get_response_format()
+
+    key = get_request_key(
+        snap.version,
+        "rank:{}".format(format),
+        barrier_type,
+        layer,
+        ids,
+        filters,
+        weights,
+    )
+    etag = get_etag(key)
+    not_modified = get_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    def get_body():
+        with timed("select"):
+            positions = select_units(data, layer, ids)
+
+        with timed("filter"):
+            df = data.df.iloc[data.filters.select(positions, filters)]
+
+        nrows = len(df.index)
+
+        log.info("selected {} dams".format(nrows))
+
+        # TODO: return a 204 instead?
+        if not nrows:
+            abort(
+                404,
+                "no dams are contained in selected ids {0}:{1}".format(
+                    layer, ",".join(ids)
+                ),
+            )
+
+        # just return tiers and lat/lon
+        cols = ["lat", "lon"] + TIER_FIELDS
+        with timed("tiers"):
+            tiers = get_unit_tiers(data, layer, ids, filters, weights)
+            if tiers is None:
+                tiers = get_custom_tiers(
+                    df,
+                    get_request_key(
+                        snap.version,
+                        "tiers",
+                        barrier_type,
+                        layer,
+                        ids,
+                        filters,
+                        weights,
+                    ),
+                    weights,
+                )
+            df = df[cols].join(tiers)
+
+        with timed("serialize"):
+            return serialize(df, format)
+
+    body = get_result(key, get_body)
+
+    return make_table_response(body, format, etag, key)
+
+
+@app.route("/api/v1/<barrier_type>/rank/<layer>/batch", methods=["GET"])
+def rank_batch(barrier_type="dams", layer="HUC8"):
+    """Rank several selections of summary units, using the same filters for each.
+
+    Tiers for all selections are calculated in a single pass, with each selection
+    ranked independently of the others.
 
-    filterKeys = [a for a in request.args if not a == "id"]
-    # TODO: make this more efficient
-    for filter in filterKeys:
-        # convert all incoming to integers
-        values = [int(x) for x in request.args.get(filter).split(",")]
-        filters = filters & df[field_map[filter]].isin(values)
+    Path parameters:
+    <barrier_type> : one of TYPES
+    <layer> : one of LAYERS
+
+    Query parameters:
+    * id: selections of ids separated by semicolons; ids within each selection are
+      comma-delimited, e.g., id=<id1>;<id2>,<id3>
+    * format: str, one of 'csv', 'arrow' (default: based on Accept header, otherwise 'csv')
+    * weights: optional comma-delimited list of <metric>:<weight> for the custom scenario,
+      using lowercased names of CUSTOM_METRICS
+    * filters are defined using a lowercased version of column name and a comma-delimited list of values
+
+    Returns the same fields as rank() for each selection, with a selection field
+    containing the sorted, comma-delimited ids of that selection.  Records are
+    sorted by selection, and records within more than one selection are included
+    for each.  CSV responses are streamed.
+    """
 
-    df = df.loc[filters].copy()
-    nrows = len(df.index)
+    args = request.args
 
-    log.info("selected {} dams".format(nrows))
+    validate_type(barrier_type)
 
-    # TODO: return a 204 instead?
-    if not nrows:
+    if layer == AREA_LAYER or not layer in LAYERS:
         abort(
-            404,
-            "no dams are contained in selected ids {0}:{1}".format(
-                layer, ",".join(ids)
+            400,
+            "layer is not valid: {0}; must be one of {1}".format(
+                layer, ", ".join(LAYERS)
             ),
         )
 
-    # just return tiers and lat/lon
-    cols = ["lat", "lon"] + TIER_FIELDS + CUSTOM_TIER_FIELDS
-    df = calculate_tiers(df)[cols]
+    if layer == "County":
+        layer = "COUNTYFIPS"
 
-    resp = make_response(
-        df.to_csv(index_label="id", header=[c.lower() for c in df.columns])
+    selections = {
+        ",".join(sorted(set(id for id in selection.split(",") if id)))
+        for selection in args.get("id", "").split(";")
+    }
+    selections = sorted(selections - {""})
+    if not selections:
+        abort(400, "id must be non-empty")
+
+    snap = snapshot
+    data = snap.get(barrier_type)
+
+    if barrier_type == "dams":
+        field_map = dam_filter_field_map
+    else:
+        field_map = barrier_filter_field_map
+
+    filters = get_filters(field_map)
+    weights = get_weights()
+    format = get_response_format()
+
+    # selections are kept intact in the key by using them as ids
+    key = get_request_key(
+        snap.version,
+        "rank_batch:{}".format(format),
+        barrier_type,
+        layer,
+        selections,
+        filters,
+        weights,
     )
-    resp.headers["Content-Type"] = "text/csv"
-    return resp
+    etag = get_etag(key)
+    not_modified = get_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    with timed("select"):
+        positions = [
+            select_units(data, layer, selection.split(",")) for selection in selections
+        ]
+
+    with timed("filter"):
+        mask = data.filters.mask(filters)
+        if mask is not None:
+            positions = [p[get_bits(mask, p)] for p in positions]
+
+    # the index of the selection is used as the group of each record
+    groups = np.repeat(np.arange(len(selections)), [len(p) for p in positions])
+    positions = np.concatenate(positions)
+
+    log.info(
+        "selected {0} dams in {1} selections".format(len(positions), len(selections))
+    )
+
+    with timed("tiers"):
+        metrics = (
+            data.df[CUSTOM_METRICS if weights else METRICS]
+            .iloc[positions]
+            .reset_index(drop=True)
+        )
+        tiers = calculate_group_tiers(metrics, groups, weights=weights)
+
+    df = data.df.iloc[positions][["lat", "lon"] + TIER_FIELDS].copy()
+    df.insert(0, "selection", np.asarray(selections, dtype="object")[groups])
+    for field in CUSTOM_TIER_FIELDS + (CUSTOM_WEIGHT_TIER_FIELDS if weights else []):
+        df[field] = tiers[field].values.astype("int8")
+
+    if format == "arrow":
+        with timed("serialize"):
+            body = serialize(df, format)
+
+        return make_table_response(body, format, etag)
+
+    df.columns = [c.lower() for c in df.columns]
+    resp = Response(
+        g.timer.iter("serialize", iter_csv(df, index_label="id")),
+        mimetype=RESPONSE_FORMATS[format],
+    )
+    resp.headers["Vary"] = VARY
+    return add_cache_headers(resp, etag)
 
 
 @app.route("/api/v1/<barrier_type>/<format>/<layer>", methods=["GET"])
@@ -244,13 +1522,21 @@ def download(barrier_type="dams", layer="HUC8", format="CSV"):
 
     Path parameters:
     <barrier_type> : one of TYPES
-    <layer> : one of LAYERS
+    <layer> : one of LAYERS, or AREA_LAYER
 
     Query parameters:
     * id: list of ids
+    * bbox or geometry: area to select if layer is AREA_LAYER; see get_ids()
     * custom: bool (default: False); set to true to perform custom ranking of subset defined here
     * unranked: bool (default: False); set to true to include unranked barriers in output
-    * sort: str, one of 'NC', 'WC', 'NCWC'
+    * sort: str, one of 'NC', 'WC', 'NCWC', or 'CUSTOM' if weights are provided
+    * weights: optional comma-delimited list of <metric>:<weight> for the custom scenario,
+      using lowercased names of CUSTOM_METRICS; implies custom ranking
+    * fields: optional comma-delimited list of lowercased fields to export, from
+      DAM_EXPORT_FIELDS or SB_EXPORT_FIELDS (default: all); id is not exported
+    * async: bool (default: False); set to true to build the zip file in the background
+      instead of streaming it.  Returns a 202 response with the status of the job;
+      see get_job().
     * filters are defined using a lowercased version of column name and a comma-delimited list of values
 
     Parameters
@@ -265,109 +1551,223 @@ def download(barrier_type="dams", layer="HUC8", format="CSV"):
     args = request.args
 
     # query parameters that are NOT filters
-    query_params = ("id", "unranked", "sort", "custom")
+    query_params = (
+        "id",
+        "bbox",
+        "geometry",
+        "unranked",
+        "sort",
+        "custom",
+        "weights",
+        "fields",
+        "async",
+    )
 
     validate_type(barrier_type)
     validate_layer(layer)
     validate_format(format)
 
+    weights = get_weights()
+
     sort = args.get("sort", "NCWC")
-    validate_sort(sort)
+    validate_sort(sort, weights)
 
     if layer == "County":
         layer = "COUNTYFIPS"
 
     include_unranked = bool(args.get("unranked", False))
+    background = bool(args.get("async", False))
 
-    ids = [id for id in args.get("id", "").split(",") if id]
-    if not ids:
-        abort(400, "id must be non-empty")
+    ids = get_ids(layer)
+
+    custom_ranks = args.get("custom", False) or weights is not None
 
-    custom_ranks = args.get("custom", False)
+    snap = snapshot
+    data = snap.get(barrier_type)
 
     if barrier_type == "dams":
-        df = dams
         field_map = dam_filter_field_map
         export_columns = DAM_EXPORT_FIELDS
     else:
-        df = barriers
         field_map = barrier_filter_field_map
         export_columns = SB_EXPORT_FIELDS
 
-    # drop off-network barriers if we aren't including them
-    if not include_unranked:
-        df = df.loc[df.HasNetwork]
-
-    # filter to summary units
-    df = df.loc[df[layer].isin(ids)].copy()
-    log.info("selected {} dams in geographic area".format(len(df)))
-
-    if include_unranked:
-        full_df = df.copy()
-
-    filters = None
-    filterKeys = [a for a in request.args if not a in query_params]
-    for filter in filterKeys:
-        # convert all incoming to integers
-        values = [int(x) for x in request.args.get(filter).split(",")]
-        filter_expr = df[field_map[filter]].isin(values)
-
-        if filters is None:
-            filters = filter_expr
-        else:
-            filters = filters & filter_expr
-
-    if filters is not None:
-        df = df.loc[filters].copy()
-
-    log.info("selected {} dams that meet filters".format(len(df.index)))
+    filters = get_filters(field_map, exclude=query_params)
 
+    # custom tier fields are only available for custom ranking
+    available = list(data.df.columns)
     if custom_ranks:
-        df = calculate_tiers(df)
-
-    if include_unranked:
-        # join back to full dataset
-        tier_cols = df.columns.difference(full_df.columns)
-        df = full_df.join(df[tier_cols], how="left")
-
-        df[tier_cols] = df[tier_cols].fillna(-1).astype("int8")
-
-    df = df[df.columns.intersection(export_columns)]
-
-    # Sort by tier
-    if "{}_tier" in df.columns:
-        sort_field = "{}_tier".format(sort)
-    else:
-        sort_field = "SE_{}_tier".format(sort)
+        available += CUSTOM_TIER_FIELDS + (CUSTOM_WEIGHT_TIER_FIELDS if weights else [])
+    fields = get_fields([f for f in export_columns if f in available])
+
+    # records are written without their id, so at least one other field is needed
+    if fields is not None and not fields:
+        abort(400, "fields must include at least one export field other than id")
+
+    key = get_request_key(
+        snap.version,
+        "download:{0}:{1}:{2}:{3}".format(
+            int(include_unranked), int(custom_ranks), sort, ",".join(fields or [])
+        ),
+        barrier_type,
+        layer,
+        ids,
+        filters,
+        weights,
+    )
 
-    df = df.sort_values(by=["HasNetwork", sort_field], ascending=[False, True])
+    def get_records():
+        df = data.df
+
+        # only the requested fields and those needed to rank and sort records are
+        # sliced from the data
+        columns = slice(None)
+        if fields is not None:
+            needed = set(fields) | {"HasNetwork", "SE_{}_tier".format(sort)}
+            if custom_ranks:
+                needed.update(CUSTOM_METRICS)
+            columns = [i for i, c in enumerate(df.columns) if c in needed]
+
+        # filter to summary units, dropping off-network barriers if we aren't
+        # including them
+        with timed("select"):
+            positions = select_units(
+                data, layer, ids, networks_only=not include_unranked
+            )
+
+        log.info("selected {} dams in geographic area".format(len(positions)))
+
+        with timed("filter"):
+            filtered = data.filters.select(positions, filters)
+
+        # positions are updated to the rows included in the output
+        if include_unranked:
+            full_df = df.iloc[positions, columns]
+        else:
+            positions = filtered
+
+        df = df.iloc[filtered, columns].copy()
+
+        log.info("selected {} dams that meet filters".format(len(df.index)))
+
+        if custom_ranks:
+            with timed("tiers"):
+                tiers = None
+                if not include_unranked:
+                    tiers = get_unit_tiers(data, layer, ids, filters, weights)
+
+                if tiers is None:
+                    tiers = get_custom_tiers(
+                        df,
+                        get_request_key(
+                            snap.version,
+                            "tiers",
+                            barrier_type,
+                            layer,
+                            ids,
+                            filters,
+                            weights,
+                        ),
+                        weights,
+                    )
+                df = df.join(tiers)
+
+        if include_unranked:
+            # join back to full dataset
+            tier_cols = df.columns.difference(full_df.columns)
+            df = full_df.join(df[tier_cols], how="left")
+
+            df[tier_cols] = df[tier_cols].fillna(-1).astype("int8")
+
+        df = df[df.columns.intersection(export_columns)]
+
+        # replace domain fields with values decoded at load time
+        # (joins above preserve the order of rows in positions)
+        with timed("domains"):
+            decoded_cols = data.decoded.columns.intersection(df.columns)
+            decoded = data.decoded[decoded_cols].iloc[positions]
+            for col in decoded_cols:
+                df[col] = decoded[col].values
+
+        # Sort by tier
+        if "{}_tier".format(sort) in df.columns:
+            sort_field = "{}_tier".format(sort)
+        else:
+            sort_field = "SE_{}_tier".format(sort)
+
+        df = df.sort_values(by=["HasNetwork", sort_field], ascending=[False, True])
+
+        if fields is not None:
+            df = df[df.columns.intersection(fields)]
+
+        return df
+
+    if background:
+        # the job is identified by the request, so that identical requests share it
+        job_id = get_etag(key)
+        url = request.host_url
+
+        def write(out):
+            with app.app_context():
+                _, files = get_download_files(
+                    get_records(), barrier_type, layer, ids, format, url
+                )
+                for chunk in stream_zip(files):
+                    out.write(chunk)
+
+        status = exports.submit(snap.version, job_id, write)
+        resp = make_job_response(snap.version, job_id, status)
+        if status != COMPLETE:
+            resp.status_code = 202
+        resp.headers["Location"] = url_for("get_job", job_id=job_id, _external=True)
+        return resp
+
+    def get_chunks():
+        _, files = get_download_files(
+            get_records(), barrier_type, layer, ids, format, request.host_url
+        )
+        return stream_zip(files)
 
-    # map domain fields to values
-    df.HasNetwork = df.HasNetwork.map(BOOLEAN_DOMAIN)
-    df.Excluded = df.Excluded.map(BOOLEAN_DOMAIN)
+    # the zip file is built once for identical concurrent requests, e.g., for a link
+    # sent to many people, and streamed to all of them from a spool file.  CSV
+    # serialization and zipping happen while the response is streamed, after the
+    # Server-Timing header is sent; their duration is only recorded in metrics
+    chunks = downloads.stream(key, get_chunks)
 
-    df.OwnerType = df.OwnerType.map(OWNERTYPE_DOMAIN)
-    df.ProtectedLand = df.ProtectedLand.map(BOOLEAN_DOMAIN)
-    df.HUC8_USFS = df.HUC8_USFS.map(HUC8_USFS_DOMAIN)
-    df.HUC8_COA = df.HUC8_COA.map(HUC8_COA_DOMAIN)
-    df.HUC8_SGCN = df.HUC8_SGCN.map(HUC8_SGCN_DOMAIN)
+    resp = Response(g.timer.iter("zip", chunks), mimetype="application/zip")
+    resp.headers["Content-Disposition"] = "attachment; filename={0}".format(
+        get_download_filename(format, "zip")
+    )
+    return resp
 
-    if barrier_type == "dams":
-        df.Condition = df.Condition.map(DAM_CONDITION_DOMAIN)
-        df.Construction = df.Construction.map(CONSTRUCTION_DOMAIN)
-        df.Purpose = df.Purpose.map(PURPOSE_DOMAIN)
-        df.Feasibility = df.Feasibility.map(FEASIBILITY_DOMAIN)
 
-    else:
-        df.SeverityClass = df.SeverityClass.map(BARRIER_SEVERITY_DOMAIN)
+def get_download_files(df, barrier_type, layer, ids, format, url):
+    """Create the files included in the zip file of a download.
 
-    filename = "aquatic_barrier_ranks_{0}.{1}".format(date.today().isoformat(), format)
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        records to download
+    barrier_type : str
+        one of TYPES
+    layer : str
+    ids : list-like
+    format : str
+        one of FORMATS
+    url : str
+        host URL of the API, included in the README
+
+    Returns
+    -------
+    tuple of (name of zip file, list of (filename, iterable of bytes))
+    """
+    filename = get_download_filename(format)
 
     ### reate readme
     template_values = {
         "date": date.today(),
         "version": VERSION,
-        "url": request.host_url,
+        "url": url,
         "filename": filename,
         "layer": layer,
         "ids": ", ".join(ids),
@@ -378,18 +1778,126 @@ def download(barrier_type="dams", layer="HUC8", format="CSV"):
     ### Create terms of use
     terms = render_template("terms.txt", year=date.today().year, **template_values)
 
-    zf_bytes = BytesIO()
-    with ZipFile(zf_bytes, "w") as zf:
-        zf.writestr(filename, df.to_csv(index=False))
-        zf.writestr("README.txt", readme)
-        zf.writestr("TERMS_OF_USE.txt", terms)
-        zf.write(LOGO_PATH, "SARP_logo.png")
+    # CSV is serialized in chunks as the zip file is written
+    files = [
+        (filename, iter_csv(df, index=False)),
+        ("README.txt", [readme.encode("utf-8")]),
+        ("TERMS_OF_USE.txt", [terms.encode("utf-8")]),
+        ("SARP_logo.png", [LOGO_PATH.read_bytes()]),
+    ]
 
-    resp = make_response(zf_bytes.getvalue())
-    resp.headers["Content-Disposition"] = "attachment; filename={0}".format(
-        filename.replace(format, "zip")
+    return get_download_filename(format, "zip"), files
+
+
+def get_download_filename(format, extension=None):
+    """Get name of the file of records in a download.
+
+    Parameters
+    ----------
+    format : str
+        one of FORMATS
+    extension : str, optional (default: None)
+        extension to use instead of format, e.g., "zip" for the zip file
+
+    Returns
+    -------
+    str
+    """
+    return "aquatic_barrier_ranks_{0}.{1}".format(
+        date.today().isoformat(), extension or format
     )
-    resp.headers["Content-Type"] = "application/zip"
+
+
+def make_job_response(version, job_id, status):
+    """Create JSON response with the status of a background download.
+
+    Parameters
+    ----------
+    version : str
+        data version
+    job_id : str
+    status : str
+        status of job; see ExportJobs.status()
+
+    Returns
+    -------
+    flask.Response
+    """
+    body = {"id": job_id, "status": status}
+    if status == COMPLETE:
+        body["url"] = url_for("get_job_file", job_id=job_id, _external=True)
+    elif status == FAILED:
+        body["error"] = exports.get_error(version, job_id)
+
+    return Response(json.dumps(body), mimetype="application/json")
+
+
+def validate_job(version, job_id):
+    """Get status of a background download for a data version.
+
+    Parameters
+    ----------
+    version : str
+        data version
+    job_id : str
+
+    Returns
+    -------
+    str
+        status of job; see ExportJobs.status()
+    """
+    status = None
+    if JOB_ID.match(job_id):
+        status = exports.status(version, job_id)
+
+    if status is None:
+        abort(
+            404,
+            "download {} not found; it may have expired when data were updated".format(
+                job_id
+            ),
+        )
+
+    return status
+
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Get status of a download built in the background.
+
+    Path parameters:
+    <job_id> : id returned when the download was requested with async=1
+
+    Returns JSON:
+    {
+        "id": <job_id>,
+        "status": "running", "complete", or "failed",
+        "url": <URL of zip file, if complete>,
+        "error": <error message, if failed>
+    }
+    """
+    version = snapshot.version
+    return make_job_response(version, job_id, validate_job(version, job_id))
+
+
+@app.route("/api/v1/jobs/<job_id>/download", methods=["GET"])
+def get_job_file(job_id):
+    """Download the zip file of a download built in the background.
+
+    Path parameters:
+    <job_id> : id returned when the download was requested with async=1
+    """
+    version = snapshot.version
+    if validate_job(version, job_id) != COMPLETE:
+        abort(409, "download {} is not complete".format(job_id))
+
+    path = exports.get_path(version, job_id)
+    created = date.fromtimestamp(path.stat().st_mtime)
+
+    resp = send_file(str(path), mimetype="application/zip")
+    resp.headers[
+        "Content-Disposition"
+    ] = "attachment; filename=aquatic_barrier_ranks_{}.zip".format(created.isoformat())
     return resp
 
 